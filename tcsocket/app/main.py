@@ -1,5 +1,6 @@
 import os
 import re
+from functools import lru_cache
 from html import escape
 
 from aiohttp import ClientSession, web
@@ -26,9 +27,11 @@ from .views.enquiry import clear_enquiry, enquiry
 
 async def startup(app: web.Application):
     settings: Settings = app['settings']
+    if 'pg_engine' not in app:
+        # pg_engine may already be set eg. by tests
+        app['pg_engine'] = await create_engine(settings.pg_dsn)
     redis = await create_pool(settings.redis_settings)
     app.update(
-        pg_engine=await create_engine(settings.pg_dsn),
         redis=redis,
         session=ClientSession(),
     )
@@ -80,11 +83,13 @@ def setup_routes(app):
     app.router.add_post(r'/{company}/book-appointment', book_appointment, name='book-appointment')
 
 
-def create_app(loop, *, settings: Settings = None):
-    app = web.Application(middlewares=middleware)
-    settings = settings or Settings()
-    app['settings'] = settings
-
+@lru_cache()
+def _render_index():
+    """
+    index.html only depends on environment variables so is rendered once per process.
+    """
+    # the environment is only read on the first call, so COMMIT, RELEASE_DATE and SERVER_NAME changed after that
+    # are not picked up until the process restarts
     ctx = dict(
         COMMIT=os.getenv('COMMIT', '-'),
         RELEASE_DATE=os.getenv('RELEASE_DATE', '-'),
@@ -93,7 +98,15 @@ def create_app(loop, *, settings: Settings = None):
     index_html = (THIS_DIR / 'index.html').read_text()
     for key, value in ctx.items():
         index_html = re.sub(r'\{\{ ?%s ?\}\}' % key, escape(value), index_html)
-    app['index_html'] = index_html
+    return index_html
+
+
+def create_app(loop, *, settings: Settings = None):
+    app = web.Application(middlewares=middleware)
+    settings = settings or Settings()
+    app['settings'] = settings
+
+    app['index_html'] = _render_index()
     app.on_startup.append(startup)
     app.on_cleanup.append(cleanup)
 
@@ -7,7 +7,7 @@ from typing import Union
 import boto3
 import psycopg2
 import requests
-from sqlalchemy import create_engine, select, update
+from sqlalchemy import create_engine, create_mock_engine, select, update
 from sqlalchemy.sql import functions
 
 from .models import Base, sa_companies, sa_contractors
@@ -61,8 +61,19 @@ def psycopg2_cursor(settings):
 
 
 def populate_db(engine):
-    Base.metadata.create_all(engine)
-    engine.execute(SQL_PREPARE)
+    """
+    Create types, tables and indexes with a single statement in one transaction rather than a round trip for each.
+    """
+    ddl = []
+
+    def collect_ddl(sql, *multiparams, **params):
+        ddl.append(str(sql.compile(dialect=mock_engine.dialect)).strip())
+
+    mock_engine = create_mock_engine(engine.url, collect_ddl)
+    Base.metadata.create_all(mock_engine, checkfirst=False)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(';\n'.join(ddl))
+        conn.exec_driver_sql(SQL_PREPARE)
 
 
 DROP_CONNECTIONS = """
@@ -220,8 +220,10 @@ async def authenticate(request, api_key=None):
         _check_timestamp(request['body_request_time'], now)
         body = await request.read()
     signature = request.headers.get('Signature', request.headers.get('Webhook-Signature', '<missing>'))
+    # compared as bytes since compare_digest raises TypeError on non-ascii strings
+    b_signature = signature.encode(errors='replace')
     for _api_key in api_key_choices:
-        if _api_key and signature == hmac.new(_api_key, body, hashlib.sha256).hexdigest():
+        if _api_key and hmac.compare_digest(b_signature, hmac.new(_api_key, body, hashlib.sha256).hexdigest().encode()):
             return
     raise HTTPUnauthorizedJson(
         status='invalid signature',
@@ -7,6 +7,7 @@ from types import GeneratorType
 from typing import Any, Callable
 from uuid import UUID
 
+import orjson
 from aiohttp import web
 from aiohttp.web_response import Response
 from aiopg.sa.result import RowProxy
@@ -82,13 +83,14 @@ def pretty_json(data):
 
 
 def json_response(request, *, status_=200, list_=None, **data):
+    data = data if list_ is None else list_
     if JSON_CONTENT_TYPE in request.headers.get('Accept', ''):
-        to_json = json.dumps
+        body = orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
     else:
-        to_json = pretty_json
+        body = pretty_json(data).encode()
 
     return Response(
-        body=to_json(data if list_ is None else list_).encode(),
+        body=body,
         status=status_,
         content_type=JSON_CONTENT_TYPE,
         headers=ACCESS_CONTROL_HEADERS,
@@ -181,6 +181,19 @@ def _today():
     return datetime(now.year, now.month, now.day, 0, 0)
 
 
+async def _full_count(conn, rows, offset, count_query):
+    """
+    Total number of results, taken from the "full_count" window column of the page query so no extra query is
+    required unless the page is empty.
+    """
+    if rows:
+        return rows[0].full_count
+    elif not offset:
+        return 0
+    cur = await conn.execute(count_query)
+    return (await cur.first())[0]
+
+
 async def appointment_list(request):
     company = request['company']
     pagination, offset = get_pagination(request)
@@ -191,6 +204,15 @@ async def appointment_list(request):
         where += (apt_c.service == service_id,)
 
     conn = await request['conn_manager'].get_connection()
+    cur = await conn.execute(
+        select(APT_LIST_FIELDS + (sql_f.count().over().label('full_count'),), use_labels=True)
+        .select_from(sa_appointments.join(sa_services))
+        .where(and_(*where))
+        .order_by(apt_c.start)
+        .offset(offset)
+        .limit(pagination)
+    )
+    rows = await cur.fetchall()
     results = [
         dict(
             id=row.appointments_id,
@@ -207,23 +229,14 @@ async def appointment_list(request):
             service_colour=row.services_colour,
             service_extra_attributes=row.services_extra_attributes,
         )
-        async for row in conn.execute(
-            select(APT_LIST_FIELDS, use_labels=True)
-            .select_from(sa_appointments.join(sa_services))
-            .where(and_(*where))
-            .order_by(apt_c.start)
-            .offset(offset)
-            .limit(pagination)
-        )
+        for row in rows
     ]
 
     q_count = select([sql_f.count()]).select_from(sa_appointments.join(sa_services)).where(and_(*where))
-    cur_count = await conn.execute(q_count)
-
     return json_response(
         request,
         results=results,
-        count=(await cur_count.first())[0],
+        count=await _full_count(conn, rows, offset, q_count),
     )
 
 
@@ -241,25 +254,23 @@ async def service_list(request):
     )
 
     conn = await request['conn_manager'].get_connection()
-    results = [
-        dict(row)
-        async for row in conn.execute(
-            select([q1.c.id, q1.c.name, q1.c.colour, q1.c.extra_attributes])
-            .select_from(q1)
-            .order_by(q1.c.min_start)
-            .offset(offset)
-            .limit(pagination)
-        )
-    ]
+    cur = await conn.execute(
+        select([q1.c.id, q1.c.name, q1.c.colour, q1.c.extra_attributes, sql_f.count().over().label('full_count')])
+        .select_from(q1)
+        .order_by(q1.c.min_start)
+        .offset(offset)
+        .limit(pagination)
+    )
+    rows = await cur.fetchall()
+    results = [dict(id=row.id, name=row.name, colour=row.colour, extra_attributes=row.extra_attributes) for row in rows]
 
-    cur_count = await conn.execute(
+    q_count = (
         select([sql_f.count(distinct(ser_c.id))]).select_from(sa_appointments.join(sa_services)).where(and_(*where))
     )
-
     return json_response(
         request,
         results=results,
-        count=(await cur_count.first())[0],
+        count=await _full_count(conn, rows, offset, q_count),
     )
 
 
@@ -1,39 +1,93 @@
+import asyncio
 import hashlib
 import hmac
-import json
+import inspect
 import os
 from collections import namedtuple
 from datetime import datetime
+from functools import lru_cache
 from io import BytesIO
-from itertools import product
+from pathlib import Path
 from time import time
+from urllib.parse import urlparse
 
+import orjson
 import pytest
-from aiohttp import ClientSession, ClientTimeout
+import sqlalchemy
+from aiohttp import ClientResponse, ClientSession, ClientTimeout
+from aiohttp.test_utils import TestServer
 from aiohttp.web import Application, Response, json_response
 from aiopg.sa import create_engine as aio_create_engine
 from aioredis import create_redis
 from arq import Worker
 from arq.connections import ArqRedis
-from PIL import Image, ImageDraw
+from PIL import Image
 from sqlalchemy import create_engine as sa_create_engine, select
 from sqlalchemy.sql.functions import count as count_func
 
+from tcsocket.app import models
 from tcsocket.app.main import create_app
-from tcsocket.app.management import populate_db, prepare_database
+from tcsocket.app.management import DROP_CONNECTIONS, SQL_PREPARE, populate_db, psycopg2_cursor
 from tcsocket.app.models import sa_appointments, sa_companies, sa_con_skills, sa_qual_levels, sa_services, sa_subjects
 from tcsocket.app.settings import Settings
-from tcsocket.app.worker import WorkerSettings, startup
+from tcsocket.app.worker import WorkerSettings
 
 MASTER_KEY = 'this is the master key'
 DB_DSN = 'postgresql://postgres@localhost:5432/socket_test'
+REDIS_DSN = 'redis://localhost:6379'
+# redis's "databases" config, 16 by default
+REDIS_DATABASES = int(os.getenv('REDIS_DATABASES', 16))
 
 
-async def test_image_view(request):
-    image_format = request.query.get('format')
-    stream = BytesIO()
-    request.app['request_log'].append(('test_image', image_format))
+def _suffix_database(url, suffix):
+    """
+    Append suffix to the database name in url, leaving any query string (eg. "?sslmode=require") intact.
+    """
+    conf = urlparse(url)
+    return conf._replace(path=f'{conf.path.rstrip("/")}{suffix}').geturl()
+
+
+def _database_url():
+    """
+    Each pytest-xdist worker gets its own database so workers can run in parallel, eg. "socket_test_gw0".
+    """
+    database_url = os.getenv('DATABASE_URL', DB_DSN)
+    worker_id = os.getenv('PYTEST_XDIST_WORKER')
+    if worker_id:
+        database_url = _suffix_database(database_url, f'_{worker_id}')
+    return database_url
+
+
+def _redis_url():
+    """
+    Likewise each pytest-xdist worker uses its own redis database, offset from the database in the url,
+    eg. database 1 for "gw1" with "redis://localhost:6379".
+    """
+    conf = urlparse(os.getenv('REDISCLOUD_URL', REDIS_DSN))
+    worker_id = os.getenv('PYTEST_XDIST_WORKER')
+    if not worker_id:
+        return conf.geturl()
+    database = int(conf.path.strip('/') or 0) + int(worker_id[2:])
+    if database >= REDIS_DATABASES:
+        raise RuntimeError(
+            f'xdist worker "{worker_id}" needs redis database {database} but redis only has {REDIS_DATABASES} '
+            f'databases, run fewer workers or set REDIS_DATABASES to match the "databases" redis config'
+        )
+    return conf._replace(path=f'/{database}').geturl()
 
+
+DATABASE_URL = _database_url()
+TEMPLATE_DATABASE_URL = _suffix_database(os.getenv('DATABASE_URL', DB_DSN), '_template')
+# arbitrary key for the advisory lock taken while the template database is built
+TEMPLATE_LOCK_ID = 8_734_001
+REDIS_URL = _redis_url()
+
+
+@lru_cache()
+def _build_test_image(image_format, exif):
+    """
+    The images are always the same so each variant is only encoded once per session.
+    """
     if image_format == 'RGBA':
         create_as, save_as = 'RGBA', 'PNG'
     elif image_format == 'P':
@@ -42,15 +96,27 @@ async def test_image_view(request):
         create_as, save_as = 'RGB', 'JPEG'
 
     image = Image.new(create_as, (2000, 1200), (50, 100, 150))
-    ImageDraw.Draw(image).polygon([(0, 0), (image.width, 0), (image.width, 100), (0, 100)], fill=(128, 128, 128))
-    kwargs = dict(format=save_as, optimize=True)
-    if request.query.get('exif'):
+    image.paste((128, 128, 128), (0, 0, image.width, 100))
+    if save_as == 'JPEG':
+        # skip the extra huffman optimisation pass, only the decoded pixels matter here
+        kwargs = dict(format=save_as, optimize=False, progressive=False)
+    else:
+        kwargs = dict(format=save_as, optimize=True)
+    if exif:
         kwargs['exif'] = (
             b'Exif\x00\x00MM\x00*\x00\x00\x00\x08\x00\x01\x01\x12\x00'
             b'\x03\x00\x00\x00\x01\x00\x06\x00\x00\x00\x00\x00\x00'
         )
+    stream = BytesIO()
     image.save(stream, **kwargs)
-    return Response(body=stream.getvalue(), content_type=f'image/{save_as.lower()}')
+    return stream.getvalue(), f'image/{save_as.lower()}'
+
+
+async def test_image_view(request):
+    image_format = request.query.get('format')
+    request.app['request_log'].append(('test_image', image_format))
+    body, content_type = _build_test_image(image_format, bool(request.query.get('exif')))
+    return Response(body=body, content_type=content_type)
 
 
 async def contractor_list_view(request):
@@ -256,7 +322,7 @@ async def enquiry_options_view(request):
 
 
 async def enquiry_post_view(request):
-    json_obj = await request.json()
+    json_obj = await request.json(loads=orjson.loads)
     referrer = json_obj.get('http_referrer') or ''
     if 'snap' in referrer:
         return Response(text='error', status=500)
@@ -265,7 +331,7 @@ async def enquiry_post_view(request):
 
 
 async def booking_post_view(request):
-    json_obj = await request.json()
+    json_obj = await request.json(loads=orjson.loads)
     request.app['request_log'].append(('booking_post', json_obj))
     return json_response({'status': 'booking submitted, no-op'})
 
@@ -276,7 +342,8 @@ async def grecaptcha_post_view(request):
     if 'good' in data['response']:
         d = {
             'success': True,
-            'challenge_ts': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            # the timestamp isn't checked by the app, so a fixed one will do
+            'challenge_ts': '2032-01-01T12:00:00Z',
             'hostname': request.app['grecaptcha_host'],
         }
     else:
@@ -326,7 +393,7 @@ async def _fix_redis(settings):
     addr = settings.redis_settings.host, settings.redis_settings.port
 
     redis = await create_redis(addr, db=settings.redis_settings.database, encoding='utf8', commands_factory=ArqRedis)
-    await redis.flushdb()
+    await redis.flushdb(async_op=True)
 
     yield redis
 
@@ -335,9 +402,9 @@ async def _fix_redis(settings):
 
 
 @pytest.fixture(name='worker_ctx')
-async def _fix_worker_ctx(redis, settings, db_conn):
+async def _fix_worker_ctx(redis, settings, mock_engine):
     session = ClientSession(timeout=ClientTimeout(total=10))
-    ctx = dict(settings=settings, pg_engine=MockEngine(db_conn), session=session, redis=redis)
+    ctx = dict(settings=settings, pg_engine=mock_engine, session=session, redis=redis)
 
     yield ctx
 
@@ -355,8 +422,8 @@ async def _fix_worker(redis, worker_ctx):
     await worker.close()
 
 
-@pytest.fixture
-def other_server(loop, aiohttp_server):
+@pytest.fixture(scope='session')
+def _other_server(event_loop):
     app = Application()
     app.router.add_get('/_testing/image', test_image_view)
     app.router.add_get('/api/public_contractors/', contractor_list_view)
@@ -370,9 +437,25 @@ def other_server(loop, aiohttp_server):
         grecaptcha_host='example.com',
         extra={},
     )
-    server = loop.run_until_complete(aiohttp_server(app))
+    server = TestServer(app)
+    event_loop.run_until_complete(server.start_server())
     app['extra']['server_name'] = f'http://localhost:{server.port}'
-    return server
+
+    yield server
+
+    event_loop.run_until_complete(server.close())
+
+
+@pytest.fixture
+def other_server(_other_server):
+    """
+    The mock server is started once per session, this resets the state tests inspect or modify.
+    """
+    app = _other_server.app
+    app['request_log'].clear()
+    app['grecaptcha_host'] = 'example.com'
+    app.pop('extra_attributes', None)
+    return _other_server
 
 
 @pytest.fixture
@@ -383,7 +466,8 @@ def image_download_url(other_server):
 @pytest.fixture
 def settings(other_server):
     return Settings(
-        database_url=os.getenv('DATABASE_URL', DB_DSN),
+        database_url=DATABASE_URL,
+        redis_settings=REDIS_URL,
         redis_database=7,
         master_key=MASTER_KEY,
         grecaptcha_secret='X' * 30,
@@ -393,40 +477,100 @@ def settings(other_server):
     )
 
 
+def _schema_hash():
+    """
+    Changes whenever the models, populate_db, the prepare SQL or the SQLAlchemy version (which generates the DDL)
+    change, so a stale template database gets rebuilt.
+    """
+    m = hashlib.md5(Path(models.__file__).read_bytes())
+    m.update(inspect.getsource(populate_db).encode())
+    m.update(SQL_PREPARE.encode())
+    m.update(sqlalchemy.__version__.encode())
+    return m.hexdigest()
+
+
+def _prepare_template(cur, settings_: Settings):
+    name = settings_.pg_name
+    schema_hash = _schema_hash()
+    cur.execute("SELECT shobj_description(oid, 'pg_database') FROM pg_catalog.pg_database WHERE datname=%s", (name,))
+    r = cur.fetchone()
+    if r and r[0] == schema_hash:
+        return
+    elif r:
+        cur.execute(f'ALTER DATABASE {name} is_template false')
+        cur.execute(DROP_CONNECTIONS, (name,))
+        cur.execute(f'DROP DATABASE {name}')
+
+    cur.execute(f'CREATE DATABASE {name}')
+    engine = sa_create_engine(settings_.pg_dsn)
+    populate_db(engine)
+    engine.dispose()
+    cur.execute(f"COMMENT ON DATABASE {name} IS '{schema_hash}'")
+    cur.execute(f'ALTER DATABASE {name} is_template true')
+
+
 @pytest.fixture(scope='session')
 def db():
-    settings_ = Settings(database_url=os.getenv('DATABASE_URL', DB_DSN))
-    prepare_database(True, settings_)
+    """
+    The schema is built once in a template database, each run (and each xdist worker) then gets a copy of it
+    which postgres creates by copying files rather than replaying the DDL.
+    """
+    settings_ = Settings(database_url=DATABASE_URL)
+    template_settings = Settings(database_url=TEMPLATE_DATABASE_URL)
+    # connect to the "postgres" database since neither database may exist yet
+    postgres_url = urlparse(settings_.pg_dsn)._replace(path='/postgres').geturl()
+    with psycopg2_cursor(Settings(database_url=postgres_url)) as cur:
+        # stop xdist workers racing to build the template
+        cur.execute('SELECT pg_advisory_lock(%s)', (TEMPLATE_LOCK_ID,))
+        try:
+            _prepare_template(cur, template_settings)
+        finally:
+            cur.execute('SELECT pg_advisory_unlock(%s)', (TEMPLATE_LOCK_ID,))
+
+        cur.execute(DROP_CONNECTIONS, (settings_.pg_name,))
+        cur.execute(f'DROP DATABASE IF EXISTS {settings_.pg_name}')
+        cur.execute(f'CREATE DATABASE {settings_.pg_name} TEMPLATE {template_settings.pg_name}')
+
+
+@pytest.fixture(scope='session')
+def event_loop():
+    """
+    One loop for the whole session so connections from aio_engine can be shared between tests.
+    """
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope='session')
+def aio_engine(event_loop, db):
+    engine = event_loop.run_until_complete(aio_create_engine(DATABASE_URL, loop=event_loop))
 
-    engine = sa_create_engine(settings_.pg_dsn)
-    populate_db(engine)
     yield engine
-    engine.dispose()
+
+    engine.close()
+    event_loop.run_until_complete(engine.wait_closed())
 
 
 @pytest.fixture
-def db_conn(loop, settings, db):
-    engine = loop.run_until_complete(aio_create_engine(settings.database_url, loop=loop))
-    conn = loop.run_until_complete(engine.acquire())
+def db_conn(loop, aio_engine):
+    conn = loop.run_until_complete(aio_engine.acquire())
     transaction = loop.run_until_complete(conn.begin())
 
     yield conn
 
-    loop.run_until_complete(transaction.rollback())
-    loop.run_until_complete(engine.release(conn))
-    engine.close()
-    loop.run_until_complete(engine.wait_closed())
+    async def teardown():
+        await transaction.rollback()
+        await aio_engine.release(conn)
 
+    loop.run_until_complete(teardown())
 
-class MockEngine:
-    def __init__(self, conn):
-        self._conn = conn
 
-    async def _acquire(self):
-        return self._conn
+class _MockAcquire:
+    __slots__ = ('_conn',)
 
-    def acquire(self):
-        return self
+    def __init__(self, conn):
+        self._conn = conn
 
     async def __aenter__(self):
         return self._conn
@@ -434,6 +578,21 @@ class MockEngine:
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         pass
 
+
+class MockEngine:
+    __slots__ = ('_conn', '_acquire_cm')
+
+    def __init__(self, conn):
+        self._conn = conn
+        # the same context manager can be reused since it always yields the same connection
+        self._acquire_cm = _MockAcquire(conn)
+
+    async def _acquire(self):
+        return self._conn
+
+    def acquire(self):
+        return self._acquire_cm
+
     async def release(self, conn):
         pass
 
@@ -445,7 +604,17 @@ class MockEngine:
 
 
 @pytest.fixture
-def cli(loop, aiohttp_client, db_conn, settings):
+def mock_engine(db_conn):
+    return MockEngine(db_conn)
+
+
+class OrjsonResponse(ClientResponse):
+    async def json(self, *, loads=orjson.loads, **kwargs):
+        return await super().json(loads=loads, **kwargs)
+
+
+@pytest.fixture
+def cli(loop, aiohttp_client, mock_engine, settings):
     """
     Create an app and client to interact with it
 
@@ -454,16 +623,12 @@ def cli(loop, aiohttp_client, db_conn, settings):
     """
 
     async def modify_startup(app):
-        app['pg_engine'] = MockEngine(db_conn)
-        ctx = {'settings': settings}
-        await startup(ctx)
-        ctx['pg_engine'] = app['pg_engine']
-        redis = app['redis']
-        await redis.flushdb()
+        await app['redis'].flushdb(async_op=True)
 
     app = create_app(loop, settings=settings)
+    app['pg_engine'] = mock_engine
     app.on_startup.append(modify_startup)
-    return loop.run_until_complete(aiohttp_client(app))
+    return loop.run_until_complete(aiohttp_client(app, response_class=OrjsonResponse))
 
 
 async def create_company(db_conn, public_key, private_key, name='foobar', domains=['example.com']):
@@ -482,67 +647,81 @@ def company(loop, db_conn):
     return loop.run_until_complete(create_company(db_conn, 'thepublickey', 'theprivatekey'))
 
 
+@lru_cache()
+def hmac_template(key: str, digestmod=hashlib.sha256):
+    """
+    HMAC with the key already applied, copy() it to sign a message without re-deriving the key pads every time.
+    """
+    return hmac.new(key.encode(), digestmod=digestmod)
+
+
+def sign(b_payload: bytes, key: str = MASTER_KEY, digestmod=hashlib.sha256) -> str:
+    m = hmac_template(key, digestmod).copy()
+    m.update(b_payload)
+    return m.hexdigest()
+
+
 async def signed_request(cli, url_, *, signing_key_=MASTER_KEY, method_='POST', **data):
     data.setdefault('_request_time', int(time()))
-    payload = json.dumps(data)
-    b_payload = payload.encode()
-    m = hmac.new(signing_key_.encode(), b_payload, hashlib.sha256)
+    b_payload = orjson.dumps(data)
     headers = {
-        'Webhook-Signature': m.hexdigest(),
+        'Webhook-Signature': sign(b_payload, signing_key_),
         'Content-Type': 'application/json',
     }
-    return await cli.request(method_, url_, data=payload, headers=headers)
+    return await cli.request(method_, url_, data=b_payload, headers=headers)
 
 
 async def count(db_conn, sa_table):
-    cur = await db_conn.execute(select([count_func()]).select_from(sa_table))
-    return (await cur.first())[0]
+    return await db_conn.scalar(select([count_func()]).select_from(sa_table))
 
 
 async def select_set(db_conn, *fields, select_from=None):
     q = select(fields)
     if select_from is not None:
         q = q.select_from(select_from)
-    return {tuple(cs.values()) async for cs in await db_conn.execute(q)}
+    cur = await db_conn.execute(q)
+    return {tuple(r.values()) for r in await cur.fetchall()}
 
 
 async def get(db_conn, model, *where):
-    v = await db_conn.execute(select([c for c in model.c]).where(*where))
-    v = [r async for r in v]
-    if len(v) != 1:
-        raise RuntimeError(f'get got wrong number of results: {len(v)} != 1, model: {model}')
-    return dict(v[0])
+    cur = await db_conn.execute(select([c for c in model.c]).where(*where))
+    rows = await cur.fetchall()
+    if len(rows) != 1:
+        raise RuntimeError(f'get got wrong number of results: {len(rows)} != 1, model: {model}')
+    return dict(rows[0])
+
+
+SUBJECTS = [
+    {'id': 1, 'name': 'Mathematics', 'category': 'Maths'},
+    {'id': 2, 'name': 'Language', 'category': 'English'},
+    {'id': 3, 'name': 'Literature', 'category': 'English'},
+]
+QUAL_LEVELS = [
+    {'id': 11, 'name': 'GCSE', 'ranking': 16},
+    {'id': 12, 'name': 'A Level', 'ranking': 18},
+    {'id': 13, 'name': 'Degree', 'ranking': 21},
+]
+SKILL_IDS = (1, 11), (2, 12)
 
 
 async def create_con_skills(db_conn, *con_ids):
+    await db_conn.execute(sa_subjects.insert().values(SUBJECTS))
+    await db_conn.execute(sa_qual_levels.insert().values(QUAL_LEVELS))
     await db_conn.execute(
-        sa_subjects.insert().values(
-            [
-                {'id': 1, 'name': 'Mathematics', 'category': 'Maths'},
-                {'id': 2, 'name': 'Language', 'category': 'English'},
-                {'id': 3, 'name': 'Literature', 'category': 'English'},
-            ]
-        )
-    )
-    await db_conn.execute(
-        sa_qual_levels.insert().values(
+        sa_con_skills.insert().values(
             [
-                {'id': 11, 'name': 'GCSE', 'ranking': 16},
-                {'id': 12, 'name': 'A Level', 'ranking': 18},
-                {'id': 13, 'name': 'Degree', 'ranking': 21},
+                {'contractor': con_id, 'subject': subject, 'qual_level': qual_level}
+                for con_id in con_ids
+                for subject, qual_level in SKILL_IDS
             ]
         )
     )
-    skill_ids = [(1, 11), (2, 12)]
-
-    await db_conn.execute(
-        sa_con_skills.insert().values(
-            [{'contractor': con_id, 'subject': s[0], 'qual_level': s[1]} for con_id, s in product(con_ids, skill_ids)]
-        )
-    )
 
 
-async def create_appointment(db_conn, company, create_service=True, service_extra=None, appointment_extra=None):
+async def create_appointments(db_conn, company, appointment_extras, create_service=True, service_extra=None):
+    """
+    Create appointments for one service, all appointments are inserted with a single statement.
+    """
     service_kwargs = dict(
         id=1,
         company=company.id,
@@ -557,25 +736,46 @@ async def create_appointment(db_conn, company, create_service=True, service_extr
     if create_service:
         await db_conn.execute(sa_services.insert().values(**service_kwargs))
 
-    apt_kwargs = dict(
-        id=456,
-        service=service_kwargs['id'],
-        topic='testing appointment',
-        attendees_max=42,
-        attendees_count=4,
-        attendees_current_ids=[1, 2, 3],
-        start=datetime(2032, 1, 1, 12, 0, 0),
-        finish=datetime(2032, 1, 1, 13, 0, 0),
-        price=123.45,
-        location='Whatever',
-    )
-    if appointment_extra:
-        apt_kwargs.update(appointment_extra)
-    await db_conn.execute(sa_appointments.insert().values(**apt_kwargs))
+    appointments = []
+    for appointment_extra in appointment_extras:
+        apt_kwargs = dict(
+            id=456,
+            service=service_kwargs['id'],
+            topic='testing appointment',
+            attendees_max=42,
+            attendees_count=4,
+            attendees_current_ids=[1, 2, 3],
+            start=datetime(2032, 1, 1, 12, 0, 0),
+            finish=datetime(2032, 1, 1, 13, 0, 0),
+            price=123.45,
+            location='Whatever',
+        )
+        if appointment_extra:
+            apt_kwargs.update(appointment_extra)
+        appointments.append(apt_kwargs)
+    await db_conn.execute(sa_appointments.insert().values(appointments))
 
-    return {'appointment': apt_kwargs, 'service': service_kwargs}
+    return {'appointments': appointments, 'service': service_kwargs}
+
+
+async def create_appointment(db_conn, company, create_service=True, service_extra=None, appointment_extra=None):
+    r = await create_appointments(db_conn, company, [appointment_extra], create_service, service_extra)
+    return {'appointment': r['appointments'][0], 'service': r['service']}
 
 
 @pytest.fixture
 def appointment(loop, db_conn, company):
     return loop.run_until_complete(create_appointment(db_conn, company))
+
+
+@pytest.fixture
+def route_url(cli):
+    """
+    URL of the named route for the default company, eg. route_url('contractor-list').
+    """
+
+    def _route_url(name, **kwargs):
+        kwargs.setdefault('company', 'thepublickey')
+        return cli.server.app.router[name].url_for(**kwargs)
+
+    return _route_url
@@ -1,16 +1,17 @@
 import hashlib
-import hmac
-import json
 from datetime import datetime, timedelta
+from functools import lru_cache
 from time import time
 
+import orjson
+
 from tcsocket.app.models import sa_appointments, sa_services
 
-from .conftest import count, create_appointment, create_company
+from .conftest import count, create_appointment, create_appointments, create_company, sign
 
 
-async def test_list_appointments(cli, company, appointment):
-    r = await cli.get(cli.server.app.router['appointment-list'].url_for(company='thepublickey'))
+async def test_list_appointments(cli, company, appointment, route_url):
+    r = await cli.get(route_url('appointment-list'))
     assert r.status == 200, await r.text()
     obj = await r.json()
     assert obj == {
@@ -42,25 +43,24 @@ async def test_list_appointments(cli, company, appointment):
     }
 
 
-async def test_many_apts(cli, db_conn, company):
-    await create_appointment(db_conn, company, appointment_extra={'id': 1})
-    for i in range(55):
-        await create_appointment(
-            db_conn,
-            company,
-            create_service=False,
-            appointment_extra=dict(
-                id=i + 2,
-                start=datetime(2032, 1, 1, 12, 0, 0) + timedelta(days=i + 1),
-                finish=datetime(2032, 1, 1, 13, 0, 0) + timedelta(days=i + 1),
-            ),
-        )
+async def test_many_apts(cli, db_conn, company, route_url):
+    await create_appointments(
+        db_conn,
+        company,
+        [
+            dict(
+                id=i + 1,
+                start=datetime(2032, 1, 1, 12, 0, 0) + timedelta(days=i),
+                finish=datetime(2032, 1, 1, 13, 0, 0) + timedelta(days=i),
+            )
+            for i in range(56)
+        ],
+    )
 
     assert 56 == await count(db_conn, sa_appointments)
     assert 1 == await count(db_conn, sa_services)
 
-    url = cli.server.app.router['appointment-list'].url_for(company='thepublickey')
-    r = await cli.get(url)
+    r = await cli.get(route_url('appointment-list'))
     assert r.status == 200, await r.text()
     obj = await r.json()
     assert obj['count'] == 56
@@ -68,7 +68,7 @@ async def test_many_apts(cli, db_conn, company):
     assert obj['results'][0]['start'] == '2032-01-01T12:00:00'
     assert obj['results'][-1]['start'] == '2032-01-30T12:00:00'
 
-    r = await cli.get(url.with_query({'page': '2'}))
+    r = await cli.get(route_url('appointment-list').with_query({'page': '2'}))
     assert r.status == 200, await r.text()
     obj = await r.json()
     assert obj['count'] == 56
@@ -76,18 +76,24 @@ async def test_many_apts(cli, db_conn, company):
     assert obj['results'][0]['start'] == '2032-01-31T12:00:00'
     assert obj['results'][-1]['start'] == '2032-02-25T12:00:00'
 
-    r = await cli.get(url.with_query({'pagination': '45'}))
+    r = await cli.get(route_url('appointment-list').with_query({'page': '3'}))
+    assert r.status == 200, await r.text()
+    obj = await r.json()
+    assert obj['count'] == 56
+    assert obj['results'] == []
+
+    r = await cli.get(route_url('appointment-list').with_query({'pagination': '45'}))
     assert r.status == 200, await r.text()
     obj = await r.json()
     assert len(obj['results']) == 45
 
-    r = await cli.get(url.with_query({'pagination': '100'}))
+    r = await cli.get(route_url('appointment-list').with_query({'pagination': '100'}))
     assert r.status == 200, await r.text()
     obj = await r.json()
     assert len(obj['results']) == 50
 
 
-async def test_service_filter(cli, db_conn, company):
+async def test_service_filter(cli, db_conn, company, route_url):
     n = datetime.utcnow()
     midnight = datetime(n.year, n.month, n.day)
 
@@ -101,21 +107,20 @@ async def test_service_filter(cli, db_conn, company):
     company2 = await create_company(db_conn, 'compan2_public', 'compan2_private', name='company2')
     await create_appointment(db_conn, company2, appointment_extra={'id': 5}, service_extra={'id': 4})
 
-    url = cli.server.app.router['appointment-list'].url_for(company='thepublickey')
-    r = await cli.get(url)
+    r = await cli.get(route_url('appointment-list'))
     assert r.status == 200, await r.text()
     obj = await r.json()
     assert obj['count'] == 3
-    assert {r['id'] for r in obj['results']} == {1, 2, 3}
+    assert sorted(r['id'] for r in obj['results']) == [1, 2, 3]
 
-    r = await cli.get(url.with_query({'service': '1'}))
+    r = await cli.get(route_url('appointment-list').with_query({'service': '1'}))
     assert r.status == 200, await r.text()
     obj = await r.json()
     assert obj['count'] == 2
-    assert {r['id'] for r in obj['results']} == {1, 2}
+    assert sorted(r['id'] for r in obj['results']) == [1, 2]
 
 
-async def test_service_list(cli, db_conn, company):
+async def test_service_list(cli, db_conn, company, route_url):
     await create_appointment(db_conn, company, appointment_extra={'id': 1, 'start': datetime(2033, 1, 1)})
     await create_appointment(db_conn, company, appointment_extra={'id': 2}, create_service=False)
     await create_appointment(
@@ -132,8 +137,7 @@ async def test_service_list(cli, db_conn, company):
         db_conn, company, appointment_extra={'id': 5, 'start': datetime(1986, 1, 1)}, service_extra={'id': 3}
     )
 
-    url = cli.server.app.router['service-list'].url_for(company='thepublickey')
-    r = await cli.get(url)
+    r = await cli.get(route_url('service-list'))
     assert r.status == 200, await r.text()
     obj = await r.json()
     assert obj == {
@@ -157,8 +161,47 @@ async def test_service_list(cli, db_conn, company):
     }
 
 
-def sig_sso_data(company, **kwargs):
-    expires = int(time()) + 10
+async def test_service_list_pagination(cli, db_conn, company, route_url):
+    for service_id in range(1, 4):
+        await create_appointment(
+            db_conn,
+            company,
+            appointment_extra={'id': service_id, 'start': datetime(2032, 1, service_id)},
+            service_extra={'id': service_id},
+        )
+    await create_appointment(
+        db_conn, company, appointment_extra={'id': 4, 'start': datetime(1986, 1, 1)}, service_extra={'id': 4}
+    )
+
+    r = await cli.get(route_url('service-list').with_query({'pagination': '2', 'page': '2'}))
+    assert r.status == 200, await r.text()
+    obj = await r.json()
+    assert obj['count'] == 3
+    assert [s['id'] for s in obj['results']] == [3]
+
+    r = await cli.get(route_url('service-list').with_query({'pagination': '2', 'page': '3'}))
+    assert r.status == 200, await r.text()
+    obj = await r.json()
+    assert obj['count'] == 3
+    assert obj['results'] == []
+
+
+@lru_cache()
+def booking_body(appointment_id, **student):
+    return orjson.dumps({'appointment': appointment_id, **student})
+
+
+@lru_cache()
+def sso_expires():
+    """
+    Expiry of the sso data, taken once per session so the default sso data can still be signed once per key,
+    an hour ahead to outlast the test run.
+    """
+    return int(time()) + 3600
+
+
+def _sig_sso_data(private_key, **kwargs):
+    expires = sso_expires()
     data = {
         'rt': 'Client',
         'nm': 'Testing Client',
@@ -171,14 +214,22 @@ def sig_sso_data(company, **kwargs):
         'key': f'384854-{expires}-66cba424ae7783bcacfc5a75482a48c00b5e25fa',
     }
     data.update(kwargs)
-    sso_data = json.dumps(data)
-    return {
-        'signature': hmac.new(company.private_key.encode(), sso_data.encode(), hashlib.sha1).hexdigest(),
-        'sso_data': sso_data,
-    }
+    sso_data = orjson.dumps(data)
+    signature = sign(sso_data, private_key, hashlib.sha1)
+    return {'signature': signature, 'sso_data': sso_data.decode()}
+
 
+_default_sig_sso_data = lru_cache()(_sig_sso_data)
+
+
+def sig_sso_data(company, **kwargs):
+    if kwargs:
+        return _sig_sso_data(company.private_key, **kwargs)
+    # copied since some tests modify the result
+    return dict(_default_sig_sso_data(company.private_key))
 
-async def test_check_client_data(cli, company, db_conn):
+
+async def test_check_client_data(cli, company, db_conn, route_url):
     await create_appointment(db_conn, company, appointment_extra={'id': 42, 'attendees_current_ids': [384924]})
     await create_appointment(
         db_conn,
@@ -201,7 +252,7 @@ async def test_check_client_data(cli, company, db_conn):
 
     sso_args = sig_sso_data(company, srs={'384924': 'Frank Foobar', '123': 'Other Studnets'})
 
-    url = cli.server.app.router['check-client'].url_for(company='thepublickey').with_query(sso_args)
+    url = route_url('check-client').with_query(sso_args)
     r = await cli.get(url)
     assert r.status == 200, await r.text()
     obj = await r.json()
@@ -209,10 +260,10 @@ async def test_check_client_data(cli, company, db_conn):
     assert obj['appointment_attendees'] == {'42': [384924], '43': [123, 384924], '44': [384924]}
 
 
-async def test_submit_appointment(cli, company, appointment, other_server, worker):
-    url = cli.server.app.router['book-appointment'].url_for(company='thepublickey').with_query(sig_sso_data(company))
+async def test_submit_appointment(cli, company, appointment, other_server, worker, route_url):
+    url = route_url('book-appointment').with_query(sig_sso_data(company))
     assert len(other_server.app['request_log']) == 0
-    r = await cli.post(url, data=json.dumps({'appointment': appointment['appointment']['id'], 'student_id': '4'}))
+    r = await cli.post(url, data=booking_body(appointment['appointment']['id'], student_id='4'))
     assert r.status == 201, await r.text()
     await worker.run_check()
     assert len(other_server.app['request_log']) == 1
@@ -221,21 +272,17 @@ async def test_submit_appointment(cli, company, appointment, other_server, worke
     assert 'service_recipient_name' not in other_server.app['request_log'][0][1]
 
 
-async def test_check_ok(cli, company, appointment):
-    url = cli.server.app.router['check-client'].url_for(company='thepublickey').with_query(sig_sso_data(company))
-    r = await cli.get(url, data=json.dumps({'appointment': appointment['appointment']['id'], 'student_id': '4'}))
+async def test_check_ok(cli, company, appointment, route_url):
+    url = route_url('check-client').with_query(sig_sso_data(company))
+    r = await cli.get(url, data=booking_body(appointment['appointment']['id'], student_id='4'))
     assert r.status == 200, await r.text()
     obj = await r.json()
     assert obj['status'] == 'ok'
 
 
-async def test_check_invalid(cli, company, appointment):
-    url = (
-        cli.server.app.router['check-client']
-        .url_for(company='thepublickey')
-        .with_query(sig_sso_data(company, rt='Contractor'))
-    )
-    r = await cli.get(url, data=json.dumps({'appointment': appointment['appointment']['id'], 'student_id': '4'}))
+async def test_check_invalid(cli, company, appointment, route_url):
+    url = route_url('check-client').with_query(sig_sso_data(company, rt='Contractor'))
+    r = await cli.get(url, data=booking_body(appointment['appointment']['id'], student_id='4'))
     assert r.status == 400, await r.text()
     obj = await r.json()
     assert obj['status'] == 'invalid request data'
@@ -244,22 +291,18 @@ async def test_check_invalid(cli, company, appointment):
     assert deets['msg'] == 'must be \"Client\"'
 
 
-async def test_check_expired(cli, company, appointment):
-    url = (
-        cli.server.app.router['check-client'].url_for(company='thepublickey').with_query(sig_sso_data(company, exp=123))
-    )
-    r = await cli.get(url, data=json.dumps({'appointment': appointment['appointment']['id'], 'student_id': '4'}))
+async def test_check_expired(cli, company, appointment, route_url):
+    url = route_url('check-client').with_query(sig_sso_data(company, exp=123))
+    r = await cli.get(url, data=booking_body(appointment['appointment']['id'], student_id='4'))
     assert r.status == 401, await r.text()
     obj = await r.json()
     assert obj == {'status': 'session expired'}
 
 
-async def test_submit_appointment_student_name(cli, company, appointment, other_server, worker):
-    url = cli.server.app.router['book-appointment'].url_for(company='thepublickey').with_query(sig_sso_data(company))
+async def test_submit_appointment_student_name(cli, company, appointment, other_server, worker, route_url):
+    url = route_url('book-appointment').with_query(sig_sso_data(company))
     assert len(other_server.app['request_log']) == 0
-    r = await cli.post(
-        url, data=json.dumps({'appointment': appointment['appointment']['id'], 'student_name': 'Frank Spencer'})
-    )
+    r = await cli.post(url, data=booking_body(appointment['appointment']['id'], student_name='Frank Spencer'))
     assert r.status == 201, await r.text()
     await worker.run_check()
     assert len(other_server.app['request_log']) == 1
@@ -268,53 +311,51 @@ async def test_submit_appointment_student_name(cli, company, appointment, other_
     assert other_server.app['request_log'][0][1]['service_recipient_name'] == 'Frank Spencer'
 
 
-async def test_submit_double_book(cli, company, appointment, other_server):
-    url = cli.server.app.router['book-appointment'].url_for(company='thepublickey').with_query(sig_sso_data(company))
+async def test_submit_double_book(cli, company, appointment, other_server, route_url):
+    url = route_url('book-appointment').with_query(sig_sso_data(company))
     assert len(other_server.app['request_log']) == 0
-    r = await cli.post(url, data=json.dumps({'appointment': appointment['appointment']['id'], 'student_id': '3'}))
+    r = await cli.post(url, data=booking_body(appointment['appointment']['id'], student_id='3'))
     assert r.status == 400, await r.text()
     assert {'status': 'student 3(Frank Foobar) already on appointment 456'} == await r.json()
     assert len(other_server.app['request_log']) == 0
 
 
-async def test_submit_appointment_wrong_appointment(cli, company, appointment, other_server):
-    url = cli.server.app.router['book-appointment'].url_for(company='thepublickey').with_query(sig_sso_data(company))
+async def test_submit_appointment_wrong_appointment(cli, company, appointment, other_server, route_url):
+    url = route_url('book-appointment').with_query(sig_sso_data(company))
     assert len(other_server.app['request_log']) == 0
-    r = await cli.post(url, data=json.dumps({'appointment': 987, 'student_id': 3}))
+    r = await cli.post(url, data=booking_body(987, student_id=3))
     assert r.status == 404, await r.text()
     assert {'status': 'appointment 987 not found'} == await r.json()
     assert len(other_server.app['request_log']) == 0
 
 
-async def test_submit_appointment_no_signature(cli, company, appointment, other_server):
-    url = cli.server.app.router['book-appointment'].url_for(company='thepublickey')
+async def test_submit_appointment_no_signature(cli, company, appointment, other_server, route_url):
     assert len(other_server.app['request_log']) == 0
-    r = await cli.post(url, data=json.dumps({'appointment': appointment['appointment']['id'], 'student_id': 3}))
+    r = await cli.post(route_url('book-appointment'), data=booking_body(appointment['appointment']['id'], student_id=3))
     assert r.status == 403, await r.text()
 
 
-async def test_submit_appointment_invalid_signature(cli, company, appointment, other_server):
+async def test_submit_appointment_invalid_signature(cli, company, appointment, other_server, route_url):
     sig_args = sig_sso_data(company)
     sig_args['signature'] += 'x'
-    url = cli.server.app.router['book-appointment'].url_for(company='thepublickey').with_query(sig_args)
+    url = route_url('book-appointment').with_query(sig_args)
     assert len(other_server.app['request_log']) == 0
-    r = await cli.post(url, data=json.dumps({'appointment': appointment['appointment']['id'], 'student_id': 3}))
+    r = await cli.post(url, data=booking_body(appointment['appointment']['id'], student_id=3))
     assert r.status == 403, await r.text()
 
 
-async def test_no_id_or_none(cli, company, appointment, other_server):
-    url = cli.server.app.router['book-appointment'].url_for(company='thepublickey').with_query(sig_sso_data(company))
+async def test_no_id_or_none(cli, company, appointment, other_server, route_url):
+    url = route_url('book-appointment').with_query(sig_sso_data(company))
     assert len(other_server.app['request_log']) == 0
-    r = await cli.post(url, data=json.dumps({'appointment': appointment['appointment']['id']}))
+    r = await cli.post(url, data=booking_body(appointment['appointment']['id']))
     assert r.status == 400, await r.text()
     assert 'either student_id or student_name is required' in await r.text()
 
 
-async def test_slugify(cli, db_conn, company):
+async def test_slugify(cli, db_conn, company, route_url):
     await create_appointment(db_conn, company, appointment_extra={'topic': 'appointment - is - here'})
 
-    url = cli.server.app.router['appointment-list'].url_for(company='thepublickey')
-    r = await cli.get(url)
+    r = await cli.get(route_url('appointment-list'))
     assert r.status == 200, await r.text()
     obj = await r.json()
     assert obj['results'][0]['link'] == '456-appointment-is-here'
@@ -3,7 +3,7 @@ from datetime import datetime, timedelta
 from tcsocket.app.models import sa_appointments, sa_services
 from tcsocket.app.worker import delete_old_appointments, startup
 
-from .conftest import MockEngine, count, create_appointment, create_company, select_set, signed_request
+from .conftest import count, create_appointment, create_appointments, create_company, select_set, signed_request
 
 
 async def create_apt(cli, company, url=None, **kwargs):
@@ -139,7 +139,7 @@ async def test_extra_attrs(cli, db_conn, company):
     assert result.extra_attributes == eas
 
 
-async def test_delete_old_appointments(db_conn, company, settings):
+async def test_delete_old_appointments(db_conn, company, settings, mock_engine):
     n = datetime.utcnow()
     await create_appointment(db_conn, company, appointment_extra={'id': 1, 'start': n}, service_extra={'id': 1})
 
@@ -160,7 +160,7 @@ async def test_delete_old_appointments(db_conn, company, settings):
 
     ctx = {'settings': settings}
     await startup(ctx)
-    ctx['pg_engine'] = MockEngine(db_conn)
+    ctx['pg_engine'] = mock_engine
 
     assert {(1, 1), (2, 2), (3, 3), (4, 3)} == await select_set(
         db_conn, sa_appointments.c.id, sa_appointments.c.service
@@ -193,31 +193,32 @@ async def test_clear_apts(cli, db_conn, company):
             )
         )
     )
-    await create_appointment(db_conn, company, appointment_extra={'id': 1})
-    for i in range(10):
-        await create_appointment(
-            db_conn,
-            company,
-            create_service=False,
-            appointment_extra=dict(
-                id=i + 2,
-                start=datetime(2032, 1, 1, 12, 0, 0) + timedelta(days=i + 1),
-                finish=datetime(2032, 1, 1, 13, 0, 0) + timedelta(days=i + 1),
-            ),
-        )
-
-    for i in range(11, 21):
-        await create_appointment(
-            db_conn,
-            company2,
-            create_service=False,
-            appointment_extra=dict(
+    await create_appointments(
+        db_conn,
+        company,
+        [
+            dict(
+                id=i + 1,
+                start=datetime(2032, 1, 1, 12, 0, 0) + timedelta(days=i),
+                finish=datetime(2032, 1, 1, 13, 0, 0) + timedelta(days=i),
+            )
+            for i in range(11)
+        ],
+    )
+    await create_appointments(
+        db_conn,
+        company2,
+        [
+            dict(
                 id=i + 2,
                 start=datetime(2032, 1, 1, 12, 0, 0) + timedelta(days=i + 1),
                 finish=datetime(2032, 1, 1, 13, 0, 0) + timedelta(days=i + 1),
-            ),
-            service_extra=dict(id=2),
-        )
+            )
+            for i in range(11, 21)
+        ],
+        create_service=False,
+        service_extra=dict(id=2),
+    )
 
     assert 21 == await count(db_conn, sa_appointments)
     assert 2 == await count(db_conn, sa_services)
@@ -1,11 +1,23 @@
-import json
+import orjson
 
 from tests.conftest import signed_request
 
+# other_server accepts any grecaptcha response containing "good"
+GRECAPTCHA_GOOD = 'good' * 5
+GRECAPTCHA_BAD = 'bad_' * 5
+# what other_server logs for a successful grecaptcha check from the test client
+GRECAPTCHA_GOOD_REQUEST = ('grecaptcha_post', {'secret': 'XXXXXXXXXXXXXXXXXXXXXXXXXXXXXX', 'response': GRECAPTCHA_GOOD})
 
-async def test_get_enquiry(cli, company, other_server):
+
+async def post_enquiry(cli, url, data, headers=None):
+    if headers is None:
+        headers = {'User-Agent': 'Testing Browser'}
+    return await cli.post(url, data=orjson.dumps(data), headers=headers)
+
+
+async def test_get_enquiry(cli, company, other_server, route_url):
     other_server.app['extra_attributes'] = 'default'
-    r = await cli.get(cli.server.app.router['enquiry'].url_for(company=company.public_key))
+    r = await cli.get(route_url('enquiry'))
     assert r.status == 200, await r.text()
     data = await r.json()
     assert len(data) == 2
@@ -19,7 +31,7 @@ async def test_get_enquiry(cli, company, other_server):
     # once to get immediate response, once "on the worker"
     assert other_server.app['request_log'] == ['enquiry_options']
 
-    r = await cli.get(cli.server.app.router['enquiry'].url_for(company=company.public_key))
+    r = await cli.get(route_url('enquiry'))
     assert r.status == 200, await r.text()
     data = await r.json()
     assert len(data) == 2
@@ -28,26 +40,26 @@ async def test_get_enquiry(cli, company, other_server):
     assert other_server.app['request_log'] == ['enquiry_options']
 
 
-async def test_get_enquiry_repeat(cli, company, other_server, redis, worker):
+async def test_get_enquiry_repeat(cli, company, other_server, redis, worker, route_url):
     other_server.app['extra_attributes'] = 'default'
-    r = await cli.get(cli.server.app.router['enquiry'].url_for(company=company.public_key))
+    r = await cli.get(route_url('enquiry'))
     assert r.status == 200, await r.text()
     data = await r.json()
     assert len(data['visible']) == 7
     assert other_server.app['request_log'] == ['enquiry_options']
 
-    r = await cli.get(cli.server.app.router['enquiry'].url_for(company=company.public_key))
+    r = await cli.get(route_url('enquiry'))
     assert r.status == 200, await r.text()
     data = await r.json()
     assert len(data['visible']) == 7
     assert other_server.app['request_log'] == ['enquiry_options']
 
     raw_enquiry_options = await redis.get(b'enquiry-data-%d' % company.id)
-    enquiry_options = json.loads(raw_enquiry_options)
+    enquiry_options = orjson.loads(raw_enquiry_options)
     enquiry_options['last_updated'] -= 2000
-    await redis.set(b'enquiry-data-%d' % company.id, json.dumps(enquiry_options).encode())
+    await redis.set(b'enquiry-data-%d' % company.id, orjson.dumps(enquiry_options))
 
-    r = await cli.get(cli.server.app.router['enquiry'].url_for(company=company.public_key))
+    r = await cli.get(route_url('enquiry'))
     assert r.status == 200, await r.text()
     data = await r.json()
     assert len(data['visible']) == 7
@@ -55,12 +67,12 @@ async def test_get_enquiry_repeat(cli, company, other_server, redis, worker):
     assert other_server.app['request_log'] == ['enquiry_options', 'enquiry_options']
 
 
-async def test_post_enquiry_success(cli, company, other_server, worker):
+async def test_post_enquiry_success(cli, company, other_server, worker, route_url):
     other_server.app['extra_attributes'] = 'default'
     data = {
         'client_name': 'Cat Flap',
         'client_phone': '123',
-        'grecaptcha_response': 'good' * 5,
+        'grecaptcha_response': GRECAPTCHA_GOOD,
         'terms_and_conditions': True,
         'attributes': {
             'tell-us-about-yourself': 'hello',
@@ -68,15 +80,14 @@ async def test_post_enquiry_success(cli, company, other_server, worker):
             'date-of-birth': 1969660800,
         },
     }
-    url = cli.server.app.router['enquiry'].url_for(company=company.public_key)
-    r = await cli.post(url, data=json.dumps(data), headers={'User-Agent': 'Testing Browser'})
+    r = await post_enquiry(cli, route_url('enquiry'), data)
     assert r.status == 201, await r.text()
     data = await r.json()
     assert data == {'status': 'enquiry submitted to TutorCruncher'}
     await worker.run_check()
     assert [
         'enquiry_options',
-        ('grecaptcha_post', {'secret': 'XXXXXXXXXXXXXXXXXXXXXXXXXXXXXX', 'response': 'goodgoodgoodgoodgood'}),
+        GRECAPTCHA_GOOD_REQUEST,
         (
             'enquiry_post',
             {
@@ -96,20 +107,19 @@ async def test_post_enquiry_success(cli, company, other_server, worker):
     ] == other_server.app['request_log']
 
 
-async def test_post_enquiry_datetime(cli, company, other_server, worker):
+async def test_post_enquiry_datetime(cli, company, other_server, worker, route_url):
     other_server.app['extra_attributes'] = 'datetime'
     data = {
         'client_name': 'Cat Flap',
-        'grecaptcha_response': 'good' * 5,
+        'grecaptcha_response': GRECAPTCHA_GOOD,
         'attributes': {'date-field': '2032-06-01', 'datetime-field': '2018-02-07T14:45'},
     }
-    url = cli.server.app.router['enquiry'].url_for(company=company.public_key)
-    r = await cli.post(url, data=json.dumps(data), headers={'User-Agent': 'Testing Browser'})
+    r = await post_enquiry(cli, route_url('enquiry'), data)
     assert r.status == 201, await r.text()
     await worker.run_check()
     assert [
         'enquiry_options',
-        ('grecaptcha_post', {'secret': 'XXXXXXXXXXXXXXXXXXXXXXXXXXXXXX', 'response': 'goodgoodgoodgoodgood'}),
+        GRECAPTCHA_GOOD_REQUEST,
         (
             'enquiry_post',
             {
@@ -124,16 +134,15 @@ async def test_post_enquiry_datetime(cli, company, other_server, worker):
     ] == other_server.app['request_log']
 
 
-async def test_post_enquiry_invalid_attributes(cli, company, other_server, worker):
+async def test_post_enquiry_invalid_attributes(cli, company, other_server, worker, route_url):
     other_server.app['extra_attributes'] = 'default'
     data = {
         'client_name': 'Cat Flap',
         'client_phone': '123',
-        'grecaptcha_response': 'good' * 5,
+        'grecaptcha_response': GRECAPTCHA_GOOD,
         'attributes': {'how-did-you-hear-about-us': 'spam', 'date-of-birth': 'xxx'},
     }
-    url = cli.server.app.router['enquiry'].url_for(company=company.public_key)
-    r = await cli.post(url, data=json.dumps(data), headers={'User-Agent': 'Testing Browser'})
+    r = await post_enquiry(cli, route_url('enquiry'), data)
     assert r.status == 400, await r.text()
     data = await r.json()
     await worker.run_check()
@@ -152,49 +161,47 @@ async def test_post_enquiry_invalid_attributes(cli, company, other_server, worke
     }
 
 
-async def test_post_enquiry_bad_captcha(cli, company, other_server, worker):
+async def test_post_enquiry_bad_captcha(cli, company, other_server, worker, route_url):
     data = {
         'client_name': 'Cat Flap',
         'client_phone': '123',
-        'grecaptcha_response': 'bad_' * 5,
+        'grecaptcha_response': GRECAPTCHA_BAD,
     }
-    url = cli.server.app.router['enquiry'].url_for(company=company.public_key)
-    r = await cli.post(url, data=json.dumps(data), headers={'X-Forwarded-For': '1.2.3.4'})
+    r = await post_enquiry(cli, route_url('enquiry'), data, {'X-Forwarded-For': '1.2.3.4'})
     assert r.status == 201, await r.text()
     await worker.run_check()
     assert other_server.app['request_log'] == [
         'enquiry_options',
         (
             'grecaptcha_post',
-            {'secret': 'XXXXXXXXXXXXXXXXXXXXXXXXXXXXXX', 'response': 'bad_bad_bad_bad_bad_', 'remoteip': '1.2.3.4'},
+            {'secret': 'XXXXXXXXXXXXXXXXXXXXXXXXXXXXXX', 'response': GRECAPTCHA_BAD, 'remoteip': '1.2.3.4'},
         ),
     ]
 
 
-async def test_post_enquiry_wrong_captcha_domain(cli, company, other_server, worker):
+async def test_post_enquiry_wrong_captcha_domain(cli, company, other_server, worker, route_url):
     data = {
         'client_name': 'Cat Flap',
         'client_phone': '123',
-        'grecaptcha_response': 'good' * 5,
+        'grecaptcha_response': GRECAPTCHA_GOOD,
     }
     other_server.app['grecaptcha_host'] = 'other.com'
-    url = cli.server.app.router['enquiry'].url_for(company=company.public_key)
-    r = await cli.post(url, data=json.dumps(data), headers={'User-Agent': 'Testing Browser'})
+    r = await post_enquiry(cli, route_url('enquiry'), data)
     assert r.status == 201, await r.text()
     await worker.run_check()
     assert other_server.app['request_log'] == [
         'enquiry_options',
-        ('grecaptcha_post', {'secret': 'XXXXXXXXXXXXXXXXXXXXXXXXXXXXXX', 'response': 'goodgoodgoodgoodgood'}),
+        GRECAPTCHA_GOOD_REQUEST,
     ]
 
 
-async def test_post_enquiry_400(cli, company, other_server, caplog, worker):
+async def test_post_enquiry_400(cli, company, other_server, caplog, worker, route_url):
 
     other_server.app['extra_attributes'] = 'default'
     data = {
         'client_name': 'Cat Flap',
         'client_phone': '123',
-        'grecaptcha_response': 'good' * 5,
+        'grecaptcha_response': GRECAPTCHA_GOOD,
         'attributes': {'tell-us-about-yourself': 'hello'},
     }
     headers = {
@@ -202,15 +209,14 @@ async def test_post_enquiry_400(cli, company, other_server, caplog, worker):
         'Origin': 'http://example.com',
         'Referer': 'http://cause400.com',
     }
-    url = cli.server.app.router['enquiry'].url_for(company=company.public_key)
-    r = await cli.post(url, data=json.dumps(data), headers=headers)
+    r = await post_enquiry(cli, route_url('enquiry'), data, headers)
     assert r.status == 201, await r.text()
     data = await r.json()
     await worker.run_check()
     assert data == {'status': 'enquiry submitted to TutorCruncher'}
     assert other_server.app['request_log'] == [
         'enquiry_options',
-        ('grecaptcha_post', {'secret': 'XXXXXXXXXXXXXXXXXXXXXXXXXXXXXX', 'response': 'goodgoodgoodgoodgood'}),
+        GRECAPTCHA_GOOD_REQUEST,
         (
             'enquiry_post',
             {
@@ -228,14 +234,13 @@ async def test_post_enquiry_400(cli, company, other_server, caplog, worker):
     assert '400 response posting to http://localhost:' in caplog.text
 
 
-async def test_post_enquiry_skip_grecaptcha(cli, company, other_server, worker):
+async def test_post_enquiry_skip_grecaptcha(cli, company, other_server, worker, route_url):
     data = {
         'client_name': 'Cat Flap',
         'upstream_http_referrer': 'foobar',
         'grecaptcha_response': 'mock-grecaptcha:{.private_key}'.format(company),
     }
-    url = cli.server.app.router['enquiry'].url_for(company=company.public_key)
-    r = await cli.post(url, data=json.dumps(data), headers={'User-Agent': 'Testing Browser'})
+    r = await post_enquiry(cli, route_url('enquiry'), data)
     assert r.status == 201, await r.text()
     data = await r.json()
     assert data == {'status': 'enquiry submitted to TutorCruncher'}
@@ -256,31 +261,29 @@ async def test_post_enquiry_skip_grecaptcha(cli, company, other_server, worker):
     ]
 
 
-async def test_post_enquiry_500(cli, company, caplog, worker, redis):
+async def test_post_enquiry_500(cli, company, caplog, worker, redis, route_url):
     data = {
         'client_name': 'Cat Flap',
-        'grecaptcha_response': 'good' * 5,
+        'grecaptcha_response': GRECAPTCHA_GOOD,
         'attributes': {'tell-us-about-yourself': 'hello'},
     }
     headers = {'Referer': 'http://snap.com', 'Origin': 'http://example.com'}
-    url = cli.server.app.router['enquiry'].url_for(company=company.public_key)
-    r = await cli.post(url, data=json.dumps(data), headers=headers)
+    r = await post_enquiry(cli, route_url('enquiry'), data, headers)
     assert r.status == 201, await r.text()
     await worker.run_check()
     assert '500 response posting to http://localhost:' in caplog.text
 
 
-async def test_post_enquiry_referrer_too_long(cli, company, other_server, worker):
+async def test_post_enquiry_referrer_too_long(cli, company, other_server, worker, route_url):
     data = {
         'client_name': 'Cat Flap',
         'client_phone': '123',
-        'grecaptcha_response': 'good' * 5,
+        'grecaptcha_response': GRECAPTCHA_GOOD,
         'upstream_http_referrer': 'X' * 2000,
         'attributes': {'tell-us-about-yourself': 'hello'},
     }
-    url = cli.server.app.router['enquiry'].url_for(company=company.public_key)
     headers = {'User-Agent': 'Testing Browser', 'Referer': 'Y' * 2000, 'Origin': 'http://example.com'}
-    r = await cli.post(url, data=json.dumps(data), headers=headers)
+    r = await post_enquiry(cli, route_url('enquiry'), data, headers)
     assert r.status == 201, await r.text()
     data = await r.json()
     assert data == {'status': 'enquiry submitted to TutorCruncher'}
@@ -289,17 +292,16 @@ async def test_post_enquiry_referrer_too_long(cli, company, other_server, worker
     assert other_server.app['request_log'][2][1]['http_referrer'] == 'Y' * 1023
 
 
-async def test_post_enquiry_referrer_blank(cli, company, other_server, worker):
+async def test_post_enquiry_referrer_blank(cli, company, other_server, worker, route_url):
     data = {
         'client_name': 'Cat Flap',
         'client_phone': '123',
-        'grecaptcha_response': 'good' * 5,
+        'grecaptcha_response': GRECAPTCHA_GOOD,
         'upstream_http_referrer': '',
         'attributes': {'tell-us-about-yourself': 'hello'},
     }
-    url = cli.server.app.router['enquiry'].url_for(company=company.public_key)
     headers = {'User-Agent': 'Testing Browser', 'Origin': 'http://example.com'}
-    r = await cli.post(url, data=json.dumps(data), headers=headers)
+    r = await post_enquiry(cli, route_url('enquiry'), data, headers)
     assert r.status == 201, await r.text()
     data = await r.json()
     assert data == {'status': 'enquiry submitted to TutorCruncher'}
@@ -307,10 +309,10 @@ async def test_post_enquiry_referrer_blank(cli, company, other_server, worker):
     assert other_server.app['request_log'][2][1]['upstream_http_referrer'] == ''
 
 
-async def test_clear_enquiry_options(cli, company, redis):
+async def test_clear_enquiry_options(cli, company, redis, route_url):
     assert None is await redis.get(b'enquiry-data-%d' % company.id)
 
-    r = await cli.get(cli.server.app.router['enquiry'].url_for(company=company.public_key))
+    r = await cli.get(route_url('enquiry'))
     assert r.status == 200, await r.text()
     data = await r.json()
     assert len(data['visible']) == 4
@@ -342,8 +344,8 @@ async def test_clear_enquiry_options_no_data(cli, company, redis):
     assert None is await redis.get(b'enquiry-data-%d' % company.id)
 
 
-async def test_clear_enquiry_options_invalid(cli, company, redis):
-    r = await cli.get(cli.server.app.router['enquiry'].url_for(company=company.public_key))
+async def test_clear_enquiry_options_invalid(cli, company, redis, route_url):
+    r = await cli.get(route_url('enquiry'))
     assert r.status == 200, await r.text()
     data = await r.json()
     assert len(data['visible']) == 4
@@ -360,15 +362,14 @@ async def test_clear_enquiry_options_invalid(cli, company, redis):
     assert None is not await redis.get(b'enquiry-data-%d' % company.id)
 
 
-async def test_post_all_optional(cli, company, other_server):
+async def test_post_all_optional(cli, company, other_server, route_url):
     other_server.app['extra_attributes'] = 'all_optional'
     data = {
         'client_name': 'Cat Flap',
         'client_phone': '123',
-        'grecaptcha_response': 'good' * 5,
+        'grecaptcha_response': GRECAPTCHA_GOOD,
     }
-    url = cli.server.app.router['enquiry'].url_for(company=company.public_key)
-    r = await cli.post(url, data=json.dumps(data), headers={'User-Agent': 'Testing Browser'})
+    r = await post_enquiry(cli, route_url('enquiry'), data)
     assert r.status == 201, await r.text()
     data = await r.json()
     assert data == {'status': 'enquiry submitted to TutorCruncher'}
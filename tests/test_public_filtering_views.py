@@ -1,5 +1,4 @@
 from datetime import datetime
-from operator import itemgetter
 
 import pytest
 from sqlalchemy import update
@@ -8,16 +7,17 @@ from tcsocket.app.models import sa_companies, sa_con_skills, sa_contractors, sa_
 
 from .conftest import create_con_skills, signed_request
 
+# these tests don't depend on when contractors were updated, one timestamp is shared by all of them
+NOW = datetime.now()
 
-async def test_list_contractors_origin(cli, company):
-    url = cli.server.app.router['contractor-list'].url_for(company='thepublickey')
 
-    r = await cli.get(url, headers={'Origin': 'http://example.com'})
+async def test_list_contractors_origin(cli, company, route_url):
+    r = await cli.get(route_url('contractor-list'), headers={'Origin': 'http://example.com'})
     assert r.status == 200
     assert r.headers.get('Access-Control-Allow-Origin') == '*'
     assert {'results': [], 'location': None, 'count': 0} == await r.json()
 
-    r = await cli.get(url, headers={'Origin': 'http://different.com'})
+    r = await cli.get(route_url('contractor-list'), headers={'Origin': 'http://different.com'})
     assert r.status == 403
     assert r.headers.get('Access-Control-Allow-Origin') == '*'
     assert {
@@ -37,7 +37,7 @@ async def test_list_contractors_origin(cli, company):
         (['localhost'], 'http://localhost:8000', 200),
     ],
 )
-async def test_list_contractors_domains(cli, company, domains, origin, response):
+async def test_list_contractors_domains(cli, company, domains, origin, response, route_url):
     r = await signed_request(
         cli,
         f'/{company.public_key}/webhook/options',
@@ -46,18 +46,18 @@ async def test_list_contractors_domains(cli, company, domains, origin, response)
     )
     assert r.status == 200, await r.text()
 
-    url = cli.server.app.router['contractor-list'].url_for(company='thepublickey')
-    r = await cli.get(url, headers={'Origin': origin})
+    r = await cli.get(route_url('contractor-list'), headers={'Origin': origin})
     assert r.status == response
 
 
-async def test_list_contractors_referrer(cli, company):
-    url = cli.server.app.router['contractor-list'].url_for(company='thepublickey')
-    r = await cli.get(url, headers={'Origin': 'https://example.com', 'Referer': 'http://www.whatever.com'})
+async def test_list_contractors_referrer(cli, company, route_url):
+    r = await cli.get(
+        route_url('contractor-list'), headers={'Origin': 'https://example.com', 'Referer': 'http://www.whatever.com'}
+    )
     assert r.status == 200
-    r = await cli.get(url, headers={'Referer': 'http://www.whatever.com'})
+    r = await cli.get(route_url('contractor-list'), headers={'Referer': 'http://www.whatever.com'})
     assert r.status == 403
-    r = await cli.get(url)
+    r = await cli.get(route_url('contractor-list'))
     assert r.status == 200
 
 
@@ -75,18 +75,18 @@ async def test_list_contractors_referrer(cli, company):
         ('subject=3&qual_level=11', 0),
     ],
 )
-async def test_filter_contractors_skills(cli, db_conn, company, filter_args, con_count):
+async def test_filter_contractors_skills(cli, db_conn, company, filter_args, con_count, route_url):
     await db_conn.execute(
         sa_contractors.insert().values(
             [
-                dict(id=1, company=company.id, first_name='Fred', last_name='Bloggs', last_updated=datetime.now()),
-                dict(id=2, company=company.id, first_name='con2', last_name='tractor', last_updated=datetime.now()),
+                dict(id=1, company=company.id, first_name='Fred', last_name='Bloggs', last_updated=NOW),
+                dict(id=2, company=company.id, first_name='con2', last_name='tractor', last_updated=NOW),
             ]
         )
     )
     await create_con_skills(db_conn, 1)
 
-    url = str(cli.server.app.router['contractor-list'].url_for(company=company.public_key))
+    url = str(route_url('contractor-list'))
     r = await cli.get(url + '?' + filter_args)
     assert r.status == 200, await r.text()
     obj = await r.json()
@@ -96,16 +96,16 @@ async def test_filter_contractors_skills(cli, db_conn, company, filter_args, con
         assert obj['results'][0]['link'] == '1-fred-b'
 
 
-async def test_filter_contractors_skills_distinct(cli, db_conn, company):
+async def test_filter_contractors_skills_distinct(cli, db_conn, company, route_url):
     await db_conn.execute(
         sa_contractors.insert().values(
-            id=1, company=company.id, first_name='Fred', last_name='Bloggs', last_updated=datetime.now()
+            id=1, company=company.id, first_name='Fred', last_name='Bloggs', last_updated=NOW
         )
     )
     await create_con_skills(db_conn, 1)
     await db_conn.execute(sa_con_skills.insert().values({'contractor': 1, 'subject': 1, 'qual_level': 12}))
 
-    url = str(cli.server.app.router['contractor-list'].url_for(company=company.public_key))
+    url = str(route_url('contractor-list'))
     r = await cli.get(url + '?subject=1')
     assert r.status == 200, await r.text()
     obj = await r.json()
@@ -113,14 +113,14 @@ async def test_filter_contractors_skills_distinct(cli, db_conn, company):
     assert len(obj['results']) == 1, obj
 
 
-async def test_filter_contractors_skills_invalid(cli, db_conn, company):
+async def test_filter_contractors_skills_invalid(cli, db_conn, company, route_url):
     await db_conn.execute(
         sa_contractors.insert().values(
-            id=1, company=company.id, first_name='Fred', last_name='Bloggs', last_updated=datetime.now()
+            id=1, company=company.id, first_name='Fred', last_name='Bloggs', last_updated=NOW
         )
     )
 
-    url = str(cli.server.app.router['contractor-list'].url_for(company=company.public_key)) + '?subject=foobar'
+    url = str(route_url('contractor-list')) + '?subject=foobar'
     r = await cli.get(url)
     assert r.status == 400, await r.text()
     obj = await r.json()
@@ -131,8 +131,8 @@ async def test_subject_list(cli, db_conn, company):
     await db_conn.execute(
         sa_contractors.insert().values(
             [
-                dict(id=1, company=company.id, first_name='Fred', last_name='Bloggs', last_updated=datetime.now()),
-                dict(id=2, company=company.id, first_name='con2', last_name='tractor', last_updated=datetime.now()),
+                dict(id=1, company=company.id, first_name='Fred', last_name='Bloggs', last_updated=NOW),
+                dict(id=2, company=company.id, first_name='con2', last_name='tractor', last_updated=NOW),
             ]
         )
     )
@@ -154,8 +154,8 @@ async def test_qual_level_list(cli, db_conn, company):
     await db_conn.execute(
         sa_contractors.insert().values(
             [
-                dict(id=1, company=company.id, first_name='Fred', last_name='Bloggs', last_updated=datetime.now()),
-                dict(id=2, company=company.id, first_name='con2', last_name='tractor', last_updated=datetime.now()),
+                dict(id=1, company=company.id, first_name='Fred', last_name='Bloggs', last_updated=NOW),
+                dict(id=2, company=company.id, first_name='con2', last_name='tractor', last_updated=NOW),
             ]
         )
     )
@@ -178,7 +178,7 @@ async def test_qual_level_list(cli, db_conn, company):
         ({'location': 'SW1W 0ENx', 'max_distance': 4000}, []),
     ],
 )
-async def test_distance_filter(cli, db_conn, company, params, con_distances):
+async def test_distance_filter(cli, db_conn, company, params, con_distances, route_url):
     await db_conn.execute(
         sa_contractors.insert().values(
             [
@@ -189,7 +189,7 @@ async def test_distance_filter(cli, db_conn, company, params, con_distances):
                     longitude=-0.1,
                     first_name='b_con1',
                     last_name='t',
-                    last_updated=datetime.now(),
+                    last_updated=NOW,
                 ),
                 dict(
                     id=2,
@@ -198,21 +198,21 @@ async def test_distance_filter(cli, db_conn, company, params, con_distances):
                     longitude=0,
                     first_name='a_con2',
                     last_name='t',
-                    last_updated=datetime.now(),
+                    last_updated=NOW,
                 ),
             ]
         )
     )
 
-    url = str(cli.server.app.router['contractor-list'].url_for(company=company.public_key))
+    url = str(route_url('contractor-list'))
     r = await cli.get(url, params=params, headers={'X-Forwarded-For': '1.1.1.1', 'CF-IPCountry': 'GB'})
     assert r.status == 200, await r.text()
     obj = await r.json()
-    assert list(map(itemgetter('link', 'distance'), obj['results'])) == con_distances
+    assert [(c['link'], c['distance']) for c in obj['results']] == con_distances
 
 
-async def test_geocode_cache(cli, other_server, company):
-    url = str(cli.server.app.router['contractor-list'].url_for(company=company.public_key))
+async def test_geocode_cache(cli, other_server, company, route_url):
+    url = str(route_url('contractor-list'))
     country = {'CF-IPCountry': 'GB'}
     r = await cli.get(url, params={'location': 'SW1W 0EN'}, headers={'X-Forwarded-For': '1.1.1.1', **country})
     assert r.status == 200, await r.text()
@@ -231,8 +231,8 @@ async def test_geocode_cache(cli, other_server, company):
     assert other_server.app['request_log'] == [('geocode', 'SW1W 0EN|uk')]
 
 
-async def test_geocode_rate_limit(cli, other_server, company):
-    url = str(cli.server.app.router['contractor-list'].url_for(company=company.public_key))
+async def test_geocode_rate_limit(cli, other_server, company, route_url):
+    url = str(route_url('contractor-list'))
     country = {'CF-IPCountry': 'GB'}
     for i in range(20):
         r = await cli.get(url, params={'location': f'SW1W {i}EN'}, headers={'X-Forwarded-For': '1.1.1.1', **country})
@@ -253,15 +253,15 @@ async def test_geocode_rate_limit(cli, other_server, company):
     assert len(other_server.app['request_log']) == 21
 
 
-async def test_geocode_error(cli, other_server, company):
-    url = str(cli.server.app.router['contractor-list'].url_for(company=company.public_key))
+async def test_geocode_error(cli, other_server, company, route_url):
+    url = str(route_url('contractor-list'))
     r = await cli.get(url, params={'location': '500'}, headers={'X-Forwarded-For': '1.1.1.1', 'CF-IPCountry': 'GB'})
     assert r.status == 500, await r.text()
 
 
-async def test_geocode_other_country(cli, other_server, company):
+async def test_geocode_other_country(cli, other_server, company, route_url):
     r = await cli.get(
-        cli.server.app.router['contractor-list'].url_for(company=company.public_key),
+        route_url('contractor-list'),
         params={'location': 'SW1W 0EN'},
         headers={'X-Forwarded-For': '1.1.1.1', 'CF-IPCountry': 'US'},
     )
@@ -299,26 +299,34 @@ async def create_labels(db_conn, company):
         ('label=apple&label_exclude=carrot', ['2-ben-x']),
     ],
 )
-async def test_label_filter(cli, db_conn, company, filter_args, cons):
+async def test_label_filter(cli, db_conn, company, filter_args, cons, route_url):
     await db_conn.execute(
         sa_contractors.insert().values(
             [
-                dict(id=1, company=company.id, first_name='Anne', last_name='x', last_updated=datetime.now()),
-                dict(id=2, company=company.id, first_name='Ben', last_name='x', last_updated=datetime.now()),
-                dict(id=3, company=company.id, first_name='Charlie', last_name='x', last_updated=datetime.now()),
-                dict(id=4, company=company.id, first_name='Dave', last_name='x', last_updated=datetime.now()),
+                dict(
+                    id=1,
+                    company=company.id,
+                    first_name='Anne',
+                    last_name='x',
+                    last_updated=NOW,
+                    labels=['apple', 'banana', 'carrot'],
+                ),
+                dict(id=2, company=company.id, first_name='Ben', last_name='x', last_updated=NOW, labels=['apple']),
+                dict(
+                    id=3,
+                    company=company.id,
+                    first_name='Charlie',
+                    last_name='x',
+                    last_updated=NOW,
+                    labels=['banana', 'carrot'],
+                ),
+                dict(id=4, company=company.id, first_name='Dave', last_name='x', last_updated=NOW, labels=None),
             ]
         )
     )
     await create_labels(db_conn, company)
 
-    await db_conn.execute(
-        update(sa_contractors).values(labels=['apple', 'banana', 'carrot']).where(sa_contractors.c.id == 1)
-    )
-    await db_conn.execute(update(sa_contractors).values(labels=['apple']).where(sa_contractors.c.id == 2))
-    await db_conn.execute(update(sa_contractors).values(labels=['banana', 'carrot']).where(sa_contractors.c.id == 3))
-
-    url = str(cli.server.app.router['contractor-list'].url_for(company=company.public_key))
+    url = str(route_url('contractor-list'))
     r = await cli.get(url + '?sort=name&' + filter_args)
     assert r.status == 200, await r.text()
     obj = await r.json()
@@ -340,7 +348,7 @@ async def test_labels_list(cli, db_conn, company):
         .values(name='snap', public_key='snap', private_key='snap', domains=['example.com'])
         .returning(sa_companies.c.id)
     )
-    new_company_id = [r async for r in v][0].id
+    new_company_id = (await v.first()).id
     await db_conn.execute(
         sa_labels.insert().values({'name': 'Different', 'machine_name': 'different', 'company': new_company_id})
     )
@@ -355,44 +363,52 @@ async def test_labels_list(cli, db_conn, company):
     }
 
 
-async def test_show_permissions(cli, db_conn, company):
+async def test_show_permissions(cli, db_conn, company, route_url, settings):
     await db_conn.execute(
         sa_contractors.insert().values(
             id=1,
             company=company.id,
             first_name='Fred',
             last_name='Bloggs',
-            last_updated=datetime.now(),
+            last_updated=NOW,
             labels=['foo', 'bar'],
             review_rating=3.5,
             review_duration=1800,
         )
     )
+    con = {
+        'id': 1,
+        'url': '/thepublickey/contractors/1',
+        'link': '1-fred-b',
+        'name': 'Fred B',
+        'tag_line': None,
+        'primary_description': None,
+        'town': None,
+        'country': None,
+        'photo': f'{settings.images_url}/thepublickey/1.thumb.jpg?h=-',
+        'distance': None,
+    }
 
-    url = cli.server.app.router['contractor-list'].url_for(company=company.public_key)
-    r = await cli.get(url)
+    r = await cli.get(route_url('contractor-list'))
     assert r.status == 200, await r.text()
     obj = await r.json()
-    assert obj['count'] == 1, obj
-    results = obj['results']
-    assert len(results) == 1, obj
-    assert 'labels' not in results[0], results[0]
-    assert 'review_rating' not in results[0], results[0]
-    assert 'review_duration' not in results[0], results[0]
+    assert obj == {'location': None, 'results': [con], 'count': 1}
 
     await db_conn.execute(
         update(sa_companies).values(options={'show_labels': True, 'show_stars': True, 'show_hours_reviewed': True})
     )
 
-    r = await cli.get(url)
+    r = await cli.get(route_url('contractor-list'))
     assert r.status == 200, await r.text()
     obj = await r.json()
-    results = obj['results']
-    assert results[0]['labels'] == ['foo', 'bar'], results[0]
-    assert results[0]['review_rating'] == 3.5, results[0]
-    assert results[0]['review_duration'] == 1800, results[0]
+    assert obj['results'] == [dict(con, labels=['foo', 'bar'], review_rating=3.5, review_duration=1800)]
 
 
+# built once, only the company id changes between the parametrized cases
+PAGINATION_CONS = [dict(id=i, first_name=f'Fred{i:04d}', last_name='X', last_updated=NOW) for i in range(1, 111)]
+
+
+@pytest.mark.slow
 @pytest.mark.parametrize(
     'filter_args, con_count, first_id, last_id',
     [
@@ -403,14 +419,11 @@ async def test_show_permissions(cli, db_conn, company):
         ('sort=name&pagination=40&page=2', 40, 41, 80),
     ],
 )
-async def test_contractor_pagination(cli, db_conn, company, filter_args, con_count, first_id, last_id):
-    cons = [
-        dict(id=i, company=company.id, first_name=f'Fred{i:04d}', last_name='X', last_updated=datetime.now())
-        for i in range(1, 111)
-    ]
+async def test_contractor_pagination(cli, db_conn, company, filter_args, con_count, first_id, last_id, route_url):
+    cons = [dict(con, company=company.id) for con in PAGINATION_CONS]
     await db_conn.execute(sa_contractors.insert().values(cons))
 
-    url = str(cli.server.app.router['contractor-list'].url_for(company=company.public_key))
+    url = str(route_url('contractor-list'))
     r = await cli.get(url + '?' + filter_args)
     assert r.status == 200, await r.text()
     obj = await r.json()
@@ -429,7 +442,7 @@ async def test_contractor_pagination(cli, db_conn, company, filter_args, con_cou
         ('last_updated', ['6-fred-x', '5-edgar-x', '4-dave-x', '3-charlie-x', '2-ben-x', '1-anne-x']),
     ],
 )
-async def test_sorting(cli, db_conn, company, sort, cons):
+async def test_sorting(cli, db_conn, company, sort, cons, route_url):
     await db_conn.execute(
         sa_contractors.insert().values(
             [
@@ -498,7 +511,7 @@ async def test_sorting(cli, db_conn, company, sort, cons):
     await db_conn.execute(update(sa_contractors).values(labels=['apple']).where(sa_contractors.c.id == 2))
     await db_conn.execute(update(sa_contractors).values(labels=['banana', 'carrot']).where(sa_contractors.c.id == 3))
 
-    url = str(cli.server.app.router['contractor-list'].url_for(company=company.public_key))
+    url = str(route_url('contractor-list'))
     r = await cli.get(url + '?sort=' + sort)
     assert r.status == 200, await r.text()
     obj = await r.json()
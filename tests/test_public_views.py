@@ -8,6 +8,13 @@ from tcsocket.app.models import NameOptions, sa_companies, sa_contractors
 
 from .conftest import create_con_skills
 
+# statements are immutable so the same one can be executed by every test
+INSERT_COMPANY = (
+    sa_companies.insert()
+    .values(name='testing', public_key='thepublickey', private_key='theprivatekey')
+    .returning(sa_companies.c.id)
+)
+
 
 async def test_index(cli):
     r = await cli.get('/')
@@ -35,12 +42,8 @@ async def test_favicon(cli, mocker):
     assert middleware.log_warning.call_count == 0
 
 
-async def test_list_contractors(cli, db_conn, settings):
-    v = await db_conn.execute(
-        sa_companies.insert()
-        .values(name='testing', public_key='thepublickey', private_key='theprivatekey')
-        .returning(sa_companies.c.id)
-    )
+async def test_list_contractors(cli, db_conn, settings, route_url):
+    v = await db_conn.execute(INSERT_COMPANY)
     r = await v.first()
     company_id = r.id
     await db_conn.execute(
@@ -56,7 +59,7 @@ async def test_list_contractors(cli, db_conn, settings):
     headers = {
         'HOST': 'www.example.com',
     }
-    r = await cli.get(cli.server.app.router['contractor-list'].url_for(company='thepublickey'), headers=headers)
+    r = await cli.get(route_url('contractor-list'), headers=headers)
     assert r.status == 200, await r.text()
     assert r.headers.get('Access-Control-Allow-Origin') == '*'
     obj = await r.json()
@@ -76,13 +79,13 @@ async def test_list_contractors(cli, db_conn, settings):
     ] == obj['results']
 
 
-async def test_list_contractors_name(cli, db_conn, company):
+async def test_list_contractors_name(cli, db_conn, company, route_url):
     await db_conn.execute(
         sa_contractors.insert().values(
             id=1, company=company.id, first_name='Fred', last_name='Bloggs', last_updated=datetime.now()
         )
     )
-    r = await cli.get(cli.server.app.router['contractor-list'].url_for(company='thepublickey'))
+    r = await cli.get(route_url('contractor-list'))
     assert r.status == 200, await r.text()
     assert (await r.json())['results'][0]['link'] == '1-fred-b'
     assert (await r.json())['results'][0]['name'] == 'Fred B'
@@ -94,7 +97,7 @@ async def test_list_contractors_name(cli, db_conn, company):
             .where(sa_companies.c.public_key == company.public_key)
         )
     )
-    r = await cli.get(cli.server.app.router['contractor-list'].url_for(company='thepublickey'))
+    r = await cli.get(route_url('contractor-list'))
     assert r.status == 200, await r.text()
     assert (await r.json())['results'][0]['link'] == '1-fred'
     assert (await r.json())['results'][0]['name'] == 'Fred'
@@ -106,7 +109,7 @@ async def test_list_contractors_name(cli, db_conn, company):
             .where(sa_companies.c.public_key == company.public_key)
         )
     )
-    r = await cli.get(cli.server.app.router['contractor-list'].url_for(company='thepublickey'))
+    r = await cli.get(route_url('contractor-list'))
     assert r.status == 200, await r.text()
     assert (await r.json())['results'][0]['link'] == '1-fred-bloggs'
     assert (await r.json())['results'][0]['name'] == 'Fred Bloggs'
@@ -115,23 +118,19 @@ async def test_list_contractors_name(cli, db_conn, company):
 @pytest.mark.parametrize(
     'headers, newline_count', [({'Accept': 'application/json'}, 0), ({'Accept': '*/*'}, 18), (None, 18)]
 )
-async def test_json_encoding(cli, db_conn, company, headers, newline_count):
+async def test_json_encoding(cli, db_conn, company, headers, newline_count, route_url):
     await db_conn.execute(
         sa_contractors.insert().values(
             id=1, company=company.id, first_name='Fred', last_name='Bloggs', last_updated=datetime.now()
         )
     )
-    r = await cli.get(cli.server.app.router['contractor-list'].url_for(company='thepublickey'), headers=headers)
+    r = await cli.get(route_url('contractor-list'), headers=headers)
     assert r.status == 200
     assert (await r.text()).count('\n') == newline_count
 
 
 async def test_get_contractor(cli, db_conn, settings):
-    v = await db_conn.execute(
-        sa_companies.insert()
-        .values(name='testing', public_key='thepublickey', private_key='theprivatekey')
-        .returning(sa_companies.c.id)
-    )
+    v = await db_conn.execute(INSERT_COMPANY)
     r = await v.first()
     company_id = r.id
     v = await db_conn.execute(
@@ -172,11 +171,7 @@ async def test_get_contractor(cli, db_conn, settings):
 
 
 async def test_get_contractor_doesnt_exist(cli, db_conn):
-    await db_conn.execute(
-        sa_companies.insert()
-        .values(name='testing', public_key='thepublickey', private_key='theprivatekey')
-        .returning(sa_companies.c.id)
-    )
+    await db_conn.execute(INSERT_COMPANY)
     r = await cli.get(cli.server.app.router['contractor-get'].url_for(company='thepublickey', id='123456', slug='x'))
     assert r.status == 404
     assert {} == await r.json()
@@ -187,8 +182,8 @@ async def test_missing_url(cli):
     assert r.status == 404, await r.text()
 
 
-async def test_url_trailing_slash(cli, company):
-    url = cli.server.app.router['contractor-list'].url_for(company='thepublickey')
+async def test_url_trailing_slash(cli, company, route_url):
+    url = route_url('contractor-list')
     r = await cli.get(url)
     assert r.status == 200, await r.text()
     r = await cli.get(f'{url}/', allow_redirects=False)
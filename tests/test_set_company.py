@@ -1,26 +1,32 @@
-import hashlib
-import hmac
-import json
 from datetime import datetime, timedelta
 from time import time
 
+import orjson
 import pytest
 
 from tcsocket.app.models import sa_companies, sa_contractors
 
-from .conftest import signed_request
+from .conftest import select_set, sign, signed_request
+
+CONTRACTOR_NAME_FIELDS = sa_contractors.c.id, sa_contractors.c.first_name, sa_contractors.c.last_name
+
+
+def foobar_payload():
+    """
+    Payload and signature for creating company "foobar".
+    """
+    b_payload = orjson.dumps({'name': 'foobar', '_request_time': int(time())})
+    return b_payload, sign(b_payload)
 
 
 async def test_create(cli, db_conn):
-    payload = json.dumps({'name': 'foobar', '_request_time': int(time())})
-    b_payload = payload.encode()
-    m = hmac.new(b'this is the master key', b_payload, hashlib.sha256)
+    b_payload, signature = foobar_payload()
 
     headers = {
-        'Webhook-Signature': m.hexdigest(),
+        'Webhook-Signature': signature,
         'Content-Type': 'application/json',
     }
-    r = await cli.post('/companies/create', data=payload, headers=headers)
+    r = await cli.post('/companies/create', data=b_payload, headers=headers)
     assert r.status == 201, await r.text()
     response_data = await r.json()
     curr = await db_conn.execute(sa_companies.select())
@@ -33,17 +39,16 @@ async def test_create(cli, db_conn):
 
 
 async def test_create_with_url_public_key(cli, db_conn):
-    payload = json.dumps(
+    b_payload = orjson.dumps(
         {'name': 'foobar', 'domains': ['www.example.com'], 'public_key': 'X' * 20, '_request_time': int(time())}
     )
-    b_payload = payload.encode()
-    m = hmac.new(b'this is the master key', b_payload, hashlib.sha256)
+    signature = sign(b_payload)
 
     headers = {
-        'Webhook-Signature': m.hexdigest(),
+        'Webhook-Signature': signature,
         'Content-Type': 'application/json',
     }
-    r = await cli.post('/companies/create', data=payload, headers=headers)
+    r = await cli.post('/companies/create', data=b_payload, headers=headers)
     assert r.status == 201
     response_data = await r.json()
     curr = await db_conn.execute(sa_companies.select())
@@ -59,21 +64,20 @@ async def test_create_with_url_public_key(cli, db_conn):
 
 async def test_create_with_keys(cli, db_conn, worker):
     data = {'name': 'foobar', 'public_key': 'x' * 20, 'private_key': 'y' * 40, '_request_time': int(time())}
-    payload = json.dumps(data)
-    b_payload = payload.encode()
-    m = hmac.new(b'this is the master key', b_payload, hashlib.sha256)
+    b_payload = orjson.dumps(data)
+    signature = sign(b_payload)
 
     headers = {
-        'Webhook-Signature': m.hexdigest(),
+        'Webhook-Signature': signature,
         'Content-Type': 'application/json',
     }
-    r = await cli.post('/companies/create', data=payload, headers=headers)
+    r = await cli.post('/companies/create', data=b_payload, headers=headers)
     assert r.status == 201
     curr = await db_conn.execute(sa_companies.select())
     result = await curr.first()
     assert result.name == 'foobar'
     await worker.run_check()
-    assert {(cs.id, cs.first_name, cs.last_name) async for cs in await db_conn.execute(sa_contractors.select())} == {
+    assert await select_set(db_conn, *CONTRACTOR_NAME_FIELDS) == {
         (22, 'James', 'Higgins'),
         (23, None, 'Person 2'),
     }
@@ -87,23 +91,20 @@ async def test_create_with_keys_update_contractors_false(cli, db_conn, worker):
         '_request_time': int(time()),
         'update_contractors': False,
     }
-    payload = json.dumps(data)
-    b_payload = payload.encode()
-    m = hmac.new(b'this is the master key', b_payload, hashlib.sha256)
+    b_payload = orjson.dumps(data)
+    signature = sign(b_payload)
 
     headers = {
-        'Webhook-Signature': m.hexdigest(),
+        'Webhook-Signature': signature,
         'Content-Type': 'application/json',
     }
-    r = await cli.post('/companies/create', data=payload, headers=headers)
+    r = await cli.post('/companies/create', data=b_payload, headers=headers)
     assert r.status == 201
     curr = await db_conn.execute(sa_companies.select())
     result = await curr.first()
     assert result.name == 'foobar'
     await worker.run_check()
-    assert {
-        (cs.id, cs.first_name, cs.last_name) async for cs in await db_conn.execute(sa_contractors.select())
-    } == set()
+    assert await select_set(db_conn, *CONTRACTOR_NAME_FIELDS) == set()
 
 
 async def test_create_with_keys_update_contractors_true(cli, db_conn, worker):
@@ -114,43 +115,40 @@ async def test_create_with_keys_update_contractors_true(cli, db_conn, worker):
         '_request_time': int(time()),
         'update_contractors': True,
     }
-    payload = json.dumps(data)
-    b_payload = payload.encode()
-    m = hmac.new(b'this is the master key', b_payload, hashlib.sha256)
+    b_payload = orjson.dumps(data)
+    signature = sign(b_payload)
 
     headers = {
-        'Webhook-Signature': m.hexdigest(),
+        'Webhook-Signature': signature,
         'Content-Type': 'application/json',
     }
-    r = await cli.post('/companies/create', data=payload, headers=headers)
+    r = await cli.post('/companies/create', data=b_payload, headers=headers)
     assert r.status == 201
     curr = await db_conn.execute(sa_companies.select())
     result = await curr.first()
     assert result.name == 'foobar'
     await worker.run_check()
-    assert {(cs.id, cs.first_name, cs.last_name) async for cs in await db_conn.execute(sa_contractors.select())} == {
+    assert await select_set(db_conn, *CONTRACTOR_NAME_FIELDS) == {
         (22, 'James', 'Higgins'),
         (23, None, 'Person 2'),
     }
 
 
 async def test_create_not_auth(cli):
-    data = json.dumps({'name': 'foobar', '_request_time': int(time())})
+    data, _ = foobar_payload()
     headers = {'Content-Type': 'application/json'}
     r = await cli.post('/companies/create', data=data, headers=headers)
     assert r.status == 401
 
 
 async def test_create_bad_auth(cli):
-    payload = json.dumps({'name': 'foobar', '_request_time': int(time())})
-    b_payload = payload.encode()
-    m = hmac.new(b'this is the master key', b_payload, hashlib.sha256)
+    b_payload, signature = foobar_payload()
 
     headers = {
-        'Webhook-Signature': m.hexdigest() + '1',
+        'Webhook-Signature': signature + '1',
         'Content-Type': 'application/json',
     }
-    r = await cli.post('/companies/create', data=payload, headers=headers)
+    r = await cli.post('/companies/create', data=b_payload, headers=headers)
     assert r.status == 401
 
 
@@ -160,15 +158,14 @@ async def test_create_bad_auth(cli):
 async def test_create_bad_body_time(cli, request_time):
     _request_time = request_time()
     data = {'name': 'foobar', 'public_key': 'x' * 20, 'private_key': 'y' * 40, '_request_time': _request_time}
-    payload = json.dumps(data)
-    b_payload = payload.encode()
-    m = hmac.new(b'this is the master key', b_payload, hashlib.sha256)
+    b_payload = orjson.dumps(data)
+    signature = sign(b_payload)
 
     headers = {
-        'Webhook-Signature': m.hexdigest(),
+        'Webhook-Signature': signature,
         'Content-Type': 'application/json',
     }
-    r = await cli.post('/companies/create', data=payload, headers=headers)
+    r = await cli.post('/companies/create', data=b_payload, headers=headers)
     assert r.status == 403
     assert {
         'details': f"request time '{_request_time}' not in the last 10 seconds",
@@ -184,29 +181,27 @@ async def test_create_duplicate_name(cli, company):
 
 
 async def test_create_duplicate_public_key(cli, db_conn):
-    payload = json.dumps(
+    b_payload = orjson.dumps(
         {'name': 'foobar', 'public_key': 'x' * 20, 'private_key': 'y' * 40, '_request_time': int(time())}
     )
-    b_payload = payload.encode()
-    m = hmac.new(b'this is the master key', b_payload, hashlib.sha256)
+    signature = sign(b_payload)
 
     headers = {
-        'Webhook-Signature': m.hexdigest(),
+        'Webhook-Signature': signature,
         'Content-Type': 'application/json',
     }
-    r = await cli.post('/companies/create', data=payload, headers=headers)
+    r = await cli.post('/companies/create', data=b_payload, headers=headers)
     assert r.status == 201
 
-    payload = json.dumps(
+    b_payload = orjson.dumps(
         {'name': 'foobar 2', 'public_key': 'x' * 20, 'private_key': 'z' * 40, '_request_time': int(time())}
     )
-    b_payload = payload.encode()
-    m = hmac.new(b'this is the master key', b_payload, hashlib.sha256)
+    signature = sign(b_payload)
     headers = {
-        'Webhook-Signature': m.hexdigest(),
+        'Webhook-Signature': signature,
         'Content-Type': 'application/json',
     }
-    r = await cli.post('/companies/create', data=payload, headers=headers)
+    r = await cli.post('/companies/create', data=b_payload, headers=headers)
     assert r.status == 409, await r.text()
     response_data = await r.json()
     assert response_data == {'details': 'the supplied data conflicts with an existing company', 'status': 'duplicate'}
@@ -215,10 +210,10 @@ async def test_create_duplicate_public_key(cli, db_conn):
 async def test_list(cli, company):
     payload = (datetime.now() - timedelta(seconds=2)).strftime('%s')
     b_payload = payload.encode()
-    m = hmac.new(b'this is the master key', b_payload, hashlib.sha256)
+    signature = sign(b_payload)
 
     headers = {
-        'Signature': m.hexdigest(),
+        'Signature': signature,
         'Request-Time': payload,
     }
     r = await cli.get('/companies', headers=headers)
@@ -250,10 +245,10 @@ async def test_list(cli, company):
 async def test_list_invalid_time(cli, company, payload_func, name):
     payload = payload_func()
     b_payload = payload.encode()
-    m = hmac.new(b'this is the master key', b_payload, hashlib.sha256)
+    signature = sign(b_payload)
 
     headers = {
-        'Signature': m.hexdigest(),
+        'Signature': signature,
         'Request-Time': payload,
     }
     r = await cli.get('/companies', headers=headers)
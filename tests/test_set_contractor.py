@@ -1,18 +1,22 @@
-import hashlib
-import hmac
-import json
 from io import BytesIO
 from pathlib import Path
 from time import time
 
 import boto3
+import orjson
 import pytest
 import requests
 from PIL import Image
+from sqlalchemy import select
 
 from tcsocket.app.models import sa_con_skills, sa_contractors, sa_labels, sa_qual_levels, sa_subjects
 
-from .conftest import count, get, select_set, signed_request
+from .conftest import count, get, select_set, sign, signed_request
+
+
+async def contractor_first_names(db_conn):
+    cur = await db_conn.execute(select([sa_contractors.c.first_name]))
+    return [r.first_name for r in await cur.fetchall()]
 
 
 async def test_create_master_key(cli, db_conn, company):
@@ -57,15 +61,14 @@ async def test_create_company_key(cli, db_conn, company):
 
 async def test_create_bad_auth(cli, company):
     data = dict(id=123, deleted=False, first_name='Fred', last_name='Bloggs', _request_time=time())
-    payload = json.dumps(data)
-    b_payload = payload.encode()
-    m = hmac.new(b'this is not the secret key', b_payload, hashlib.sha256)
+    b_payload = orjson.dumps(data)
+    signature = sign(b_payload, 'this is not the secret key')
 
     headers = {
-        'Webhook-Signature': m.hexdigest(),
+        'Webhook-Signature': signature,
         'Content-Type': 'application/json',
     }
-    r = await cli.post(f'/{company.public_key}/webhook/contractor', data=payload, headers=headers)
+    r = await cli.post(f'/{company.public_key}/webhook/contractor', data=b_payload, headers=headers)
     assert r.status == 401, await r.text()
 
 
@@ -320,7 +323,7 @@ async def test_photo(
     await worker.run_check()
     assert other_server.app['request_log'] == [('test_image', image_format)]
 
-    assert [cs.first_name async for cs in await db_conn.execute(sa_contractors.select())] == ['Fred']
+    assert await contractor_first_names(db_conn) == ['Fred']
     path = Path(tmpdir / company.public_key / '123.jpg')
     assert path.exists()
     with Image.open(str(path)) as im:
@@ -346,7 +349,7 @@ async def test_photo_rotation(monkeypatch, cli, db_conn, company, image_download
     await worker.run_check()
     assert other_server.app['request_log'] == [('test_image', None)]
 
-    assert [cs.first_name async for cs in await db_conn.execute(sa_contractors.select())] == ['Fred']
+    assert await contractor_first_names(db_conn) == ['Fred']
     path = Path(tmpdir / company.public_key / '123.jpg')
     assert path.exists()
     with Image.open(str(path)) as im:
@@ -360,14 +363,14 @@ async def test_photo_rotation(monkeypatch, cli, db_conn, company, image_download
 
 
 async def test_update(cli, db_conn, company):
-    assert [cs.first_name async for cs in await db_conn.execute(sa_contractors.select())] == []
+    assert await contractor_first_names(db_conn) == []
     r = await signed_request(cli, f'/{company.public_key}/webhook/contractor', id=123, first_name='Fred')
     assert r.status == 201
-    assert [cs.first_name async for cs in await db_conn.execute(sa_contractors.select())] == ['Fred']
+    assert await contractor_first_names(db_conn) == ['Fred']
 
     r = await signed_request(cli, f'/{company.public_key}/webhook/contractor', id=123, first_name='George')
     assert r.status == 200
-    assert [cs.first_name async for cs in await db_conn.execute(sa_contractors.select())] == ['George']
+    assert await contractor_first_names(db_conn) == ['George']
 
 
 async def test_real_s3_test(cli, db_conn, company, image_download_url, tmpdir, worker, settings):
@@ -375,7 +378,8 @@ async def test_real_s3_test(cli, db_conn, company, image_download_url, tmpdir, w
     assert r.status == 201, await r.text()
     await worker.run_check()
 
-    cons = sorted([(cs.first_name, cs.photo_hash) async for cs in await db_conn.execute(sa_contractors.select())])
+    cur = await db_conn.execute(select([sa_contractors.c.first_name, sa_contractors.c.photo_hash]))
+    cons = sorted((r.first_name, r.photo_hash) for r in await cur.fetchall())
     assert cons == [('Fred', '-')]
 
     r = await signed_request(
@@ -468,15 +472,14 @@ async def test_delete_skills(cli, db_conn, company):
 
 
 async def test_invalid_json(cli, company):
-    payload = 'foobar'
-    b_payload = payload.encode()
-    m = hmac.new(b'this is the master key', b_payload, hashlib.sha256)
+    b_payload = b'foobar'
+    signature = sign(b_payload)
 
     headers = {
-        'Webhook-Signature': m.hexdigest(),
+        'Webhook-Signature': signature,
         'Content-Type': 'application/json',
     }
-    r = await cli.post(f'/{company.public_key}/webhook/contractor', data=payload, headers=headers)
+    r = await cli.post(f'/{company.public_key}/webhook/contractor', data=b_payload, headers=headers)
     assert r.status == 400, await r.text()
     response_data = await r.json()
     assert response_data == {
@@ -709,9 +712,8 @@ async def test_mass_contractor_create(cli, db_conn, company, image_download_url,
     assert 2 == await count(db_conn, sa_contractors)
     await worker.run_check()
 
-    curr = await db_conn.execute(sa_contractors.select())
-    all_cons = await curr.fetchall()
-    assert all(con_id in tuple(c.id for c in all_cons) for con_id in (123, 246))
+    con_ids = await select_set(db_conn, sa_contractors.c.id)
+    assert {(123,), (246,)} <= con_ids
 
     curr = await db_conn.execute(sa_contractors.select().where(sa_contractors.c.id == 123))
     result = await curr.first()
@@ -767,9 +769,8 @@ async def test_mass_contractor_create(cli, db_conn, company, image_download_url,
     assert 3 == await count(db_conn, sa_contractors)
     await worker.run_check()
 
-    curr = await db_conn.execute(sa_contractors.select())
-    all_cons = await curr.fetchall()
-    assert all(con_id in tuple(c.id for c in all_cons) for con_id in (123, 246, 369))
+    con_ids = await select_set(db_conn, sa_contractors.c.id)
+    assert {(123,), (246,), (369,)} <= con_ids
 
     curr = await db_conn.execute(sa_contractors.select().where(sa_contractors.c.id == 123))
     result = await curr.first()
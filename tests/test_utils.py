@@ -3,12 +3,13 @@ from asyncio import Future
 from datetime import datetime
 
 import pytest
+from aiohttp.test_utils import make_mocked_request
 from aiohttp.web import Application, Response
 from psycopg2 import OperationalError
 
 from tcsocket.app import middleware
 from tcsocket.app.logs import setup_logging
-from tcsocket.app.utils import HTTPBadRequestJson, pretty_lenient_json
+from tcsocket.app.utils import HTTPBadRequestJson, json_response, pretty_lenient_json
 from tcsocket.app.worker import startup
 
 
@@ -26,6 +27,24 @@ def test_universal_encoder_error():
         pretty_lenient_json(d)
 
 
+def test_json_response_compact_non_ascii():
+    request = make_mocked_request('GET', '/', headers={'Accept': 'application/json'})
+    r = json_response(request, name='Zoë Ångström')
+    assert r.body == '{"name":"Zoë Ångström"}'.encode()
+
+
+def test_json_response_compact_types():
+    request = make_mocked_request('GET', '/', headers={'Accept': 'application/json'})
+    r = json_response(request, price=123.45, missing=float('nan'), dt=datetime(2032, 1, 1, 12), ids={1: 'x'})
+    assert r.body == b'{"price":123.45,"missing":null,"dt":"2032-01-01T12:00:00","ids":{"1":"x"}}'
+
+
+def test_json_response_pretty():
+    request = make_mocked_request('GET', '/')
+    r = json_response(request, name='Zoë', price=123.45)
+    assert r.body == b'{\n  "name": "Zo\\u00eb",\n  "price": 123.45\n}\n'
+
+
 def test_no_logging(capsys):
     logger = logging.getLogger('socket.main')
     logger.info('foobar')